@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Bodies of active documents by lender document. Entries remember which
+# document they were built from, so a stale entry is never served even if an
+# invalidation was missed by another process sharing the cache.
+
+
+def _cache():
+    return caches[settings.ACTIVE_CONTENT_CACHE]
+
+
+def _key(lender_document_id):
+    return 'active-content:{}'.format(lender_document_id)
+
+
+def get_active_content(lender_document):
+    entry = _cache().get(_key(lender_document.lender_document_id))
+    if entry is not None and entry[0] == lender_document.active_document_id:
+        return entry[1]
+    return None
+
+
+def set_active_content(lender_document_id, document, content):
+    if content is not None and len(content) > settings.ACTIVE_CONTENT_CACHE_MAX_LENGTH:
+        return
+    _cache().set(_key(lender_document_id), (document.document_id, content), settings.ACTIVE_CONTENT_CACHE_TIMEOUT)
+
+
+def invalidate_active_content(lender_document_id, unless_document_id=None):
+    key = _key(lender_document_id)
+    if unless_document_id is not None:
+        entry = _cache().get(key)
+        if entry is not None and entry[0] == unless_document_id:
+            return
+    _cache().delete(key)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from . import principal  # noqa: registers the principal cache invalidation signals
+        from . import search  # noqa: registers the search indexing signal
@@ -0,0 +1,18 @@
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication, jwt_get_username_from_payload
+
+from .principal import cache_user, get_cached_user, resolve_principal
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    # Serves the user and its principal from the principal cache, so a warm
+    # container authenticates and authorizes a token without any query
+    def authenticate_credentials(self, payload):
+        entry = get_cached_user(jwt_get_username_from_payload(payload))
+        if entry is not None:
+            user, principal = entry
+            user._principal = principal
+            return user
+        user = super().authenticate_credentials(payload)
+        user._principal = resolve_principal(user)
+        cache_user(user, user._principal)
+        return user
@@ -0,0 +1,256 @@
+import random
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_jwt.settings import api_settings as jwt_settings
+
+from api.documentrepository import get_document_repository, reset_document_repository
+from api.models import Document, Lender, LenderDocument
+from api.serializers import (
+    DOCUMENT_VALUES, LENDER_DOCUMENT_VALUES, DocumentSerializer, LenderDocumentSerializer,
+    serialize_document_values, serialize_lender_document_values
+)
+
+# Drives the document API through the Django test client against seeded data
+# and measures each endpoint. Everything random is drawn from one seeded
+# generator, so runs with the same options issue the same requests.
+
+ENDPOINTS = ('list', 'retrieve', 'create', 'publish', 'revert')
+PUBLISH_EVERY = 5
+WORDS = (
+    'lender borrower loan agreement interest rate term repayment security clause party '
+    'schedule default notice payment date amount fee charge obligation covenant'
+).split()
+
+
+@contextmanager
+def benchmark_environment():
+    # A throwaway test database and in-memory document repository, with empty caches
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(DOCUMENT_REPOSITORY_BACKEND='memory'):
+            reset_document_repository()
+            for cache in caches.all():
+                cache.clear()
+            yield
+    finally:
+        reset_document_repository()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def run_benchmark(lenders=20, document_types=5, versions=50, lines=200, requests=200, warmup=10,
+                  latency=0, endpoints=ENDPOINTS, seed=0):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    users = seed_data(rng, lenders, document_types, versions, lines)
+    seed_seconds = time.perf_counter() - started
+
+    set_simulated_latency(latency)
+    try:
+        results = {}
+        for endpoint in endpoints:
+            for _ in range(warmup):
+                request_endpoint(rng, endpoint, users)
+            results[endpoint] = measure_endpoint(rng, endpoint, users, requests)
+    finally:
+        set_simulated_latency(0)
+
+    return {
+        'config': {
+            'lenders': lenders,
+            'document_types': document_types,
+            'versions': versions,
+            'lines': lines,
+            'requests': requests,
+            'warmup': warmup,
+            'latency_ms': latency * 1000,
+            'seed': seed,
+        },
+        'seed_seconds': seed_seconds,
+        'endpoints': results,
+    }
+
+
+def seed_data(rng, lenders, document_types, versions, lines):
+    # Every lender gets a user allowed to do everything and document types with
+    # versions histories of the given depth, every PUBLISH_EVERY'th published.
+    # Returns (user, client, document rows) triples, one per lender.
+    permissions = list(Permission.objects.filter(codename__in=('read_document', 'draft_document', 'publish_document')))
+    document_repository = get_document_repository()
+    users = []
+    for i in range(lenders):
+        lender = Lender.objects.create(name='lender {}'.format(i))
+        user = User.objects.create_user(username='benchmark{}'.format(i), password='benchmark{}'.format(i))
+        user.user_permissions.set(permissions)
+        user.profile.lender = lender
+        user.save()
+        for j in range(document_types):
+            lender_document = LenderDocument.objects.create(lender=lender, name='type {}'.format(j))
+            seed_versions(rng, document_repository, lender_document, user, versions, lines)
+        token = jwt_settings.JWT_ENCODE_HANDLER(jwt_settings.JWT_PAYLOAD_HANDLER(user))
+        client = Client(HTTP_AUTHORIZATION='JWT {}'.format(token))
+        documents = list(
+            Document.objects.filter(lender=lender)
+            .values_list('document_id', 'lender_document_id', 'version_minor')
+        )
+        users.append((user, client, documents))
+    return users
+
+
+def seed_versions(rng, document_repository, lender_document, user, versions, lines):
+    content = [random_line(rng) for _ in range(lines)]
+    created_at = timezone.now() - timedelta(days=versions)
+    version_major = version_minor = 0
+    documents = []
+    for v in range(versions):
+        content[rng.randrange(lines)] = random_line(rng)
+        if v % PUBLISH_EVERY == PUBLISH_EVERY - 1:
+            version_major, version_minor = version_major + 1, 0
+        else:
+            version_minor += 1
+        body = ''.join(content)
+        s3_bucket_key = Document.versioned_key(lender_document, version_major, version_minor)
+        document_repository.put(s3_bucket_key, body)
+        documents.append(Document(
+            s3_bucket='benchmark',
+            s3_bucket_key=s3_bucket_key,
+            content_digest=Document.digest(body),
+            created_at=created_at + timedelta(days=v),
+            created_by=user,
+            version_major=version_major,
+            version_minor=version_minor,
+            lender_document=lender_document,
+            lender_id=lender_document.lender_id,
+        ))
+    Document.objects.bulk_create(documents)
+    lender_document.latest_version_major = version_major
+    lender_document.latest_version_minor = version_minor
+    lender_document.active_document = (
+        lender_document.documents.filter(version_minor=0).order_by('-version_major').first()
+    )
+    lender_document.save()
+
+
+def random_line(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 15))) + '\n'
+
+
+def set_simulated_latency(latency):
+    document_repository = get_document_repository()
+    while hasattr(document_repository, 'repository'):
+        document_repository = document_repository.repository
+    document_repository.latency = latency
+
+
+def request_endpoint(rng, endpoint, users):
+    user, client, documents = rng.choice(users)
+    document_id, lender_document_id, _ = rng.choice(documents)
+    if endpoint == 'list':
+        return client.get(reverse('document-list'), {'type': lender_document_id, 'limit': 20})
+    if endpoint == 'retrieve':
+        return client.get(reverse('document-detail', kwargs={'pk': document_id}))
+    if endpoint == 'create':
+        content = ''.join(random_line(rng) for _ in range(20))
+        return client.post(reverse('document-list'), {'lender_document_id': lender_document_id, 'content': content})
+    if endpoint == 'publish':
+        draft_id = rng.choice([d[0] for d in documents if d[2] != 0] or [document_id])
+        return client.post(reverse('document-publish', kwargs={'pk': draft_id}))
+    if endpoint == 'revert':
+        return client.post(reverse('document-revert', kwargs={'pk': document_id}))
+    raise ValueError('Unknown endpoint: {}'.format(endpoint))
+
+
+def measure_endpoint(rng, endpoint, users, requests):
+    latencies = []
+    queries = []
+    statuses = defaultdict(int)
+    started = time.perf_counter()
+    for _ in range(requests):
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = request_endpoint(rng, endpoint, users)
+            latencies.append((time.perf_counter() - request_started) * 1000)
+        queries.append(len(captured))
+        statuses[response.status_code] += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'throughput_rps': requests / elapsed if elapsed else 0,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies),
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': latencies[-1],
+        },
+        'queries': {
+            'mean': sum(queries) / len(queries),
+            'max': max(queries),
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def percentile(ordered, p):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def run_serializer_benchmark(rows=1000, repeat=5, seed=0):
+    # Times serializing rows documents, and a fifth as many lender documents,
+    # through the model serializers and through the .values() path, both on
+    # their own and together with the query that fetches them
+    rng = random.Random(seed)
+    seed_data(rng, 1, max(1, rows // PUBLISH_EVERY), PUBLISH_EVERY, 5)
+    documents = Document.objects.select_related('created_by')
+    lender_documents = LenderDocument.objects.select_related('active_document')
+    paths = {
+        'document': (
+            lambda: list(documents), lambda instances: DocumentSerializer(instances, many=True).data,
+            lambda: list(documents.values(*DOCUMENT_VALUES)), serialize_document_values,
+        ),
+        'lender_document': (
+            lambda: list(lender_documents), lambda instances: LenderDocumentSerializer(instances, many=True).data,
+            lambda: list(lender_documents.values(*LENDER_DOCUMENT_VALUES)), serialize_lender_document_values,
+        ),
+    }
+    results = {}
+    for name, (fetch_instances, serialize_instances, fetch_values, serialize_values) in paths.items():
+        instances, values = fetch_instances(), fetch_values()
+        per_1000 = 1000 * 1000 / len(instances)
+        model = best_time(lambda: serialize_instances(fetch_instances()), repeat)
+        fast = best_time(lambda: serialize_values(fetch_values()), repeat)
+        model_serialize = best_time(lambda: serialize_instances(instances), repeat)
+        fast_serialize = best_time(lambda: serialize_values(values), repeat)
+        results[name] = {
+            'rows': len(instances),
+            'model_ms_per_1000': model * per_1000,
+            'values_ms_per_1000': fast * per_1000,
+            'speedup': model / fast,
+            'model_serialize_ms_per_1000': model_serialize * per_1000,
+            'values_serialize_ms_per_1000': fast_serialize * per_1000,
+            'serialize_speedup': model_serialize / fast_serialize,
+        }
+    return {'config': {'rows': rows, 'repeat': repeat, 'seed': seed}, 'serializers': results}
+
+
+def best_time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
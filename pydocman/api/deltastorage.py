@@ -0,0 +1,31 @@
+import threading
+
+from django.conf import settings
+
+from api.documentrepository.cacheddocumentrepository import LRUCache
+
+# Bodies rebuilt from delta-encoded versions, by content digest. Rebuilding a
+# body applies every delta since the nearest snapshot, so recently read and
+# written bodies are kept to serve the next read of them, or of their successor.
+
+_reconstructed_contents = None
+_lock = threading.Lock()
+
+
+def delta_storage_enabled():
+    return settings.DOCUMENT_DELTA_SNAPSHOT_INTERVAL > 1
+
+
+def get_reconstructed_contents():
+    global _reconstructed_contents
+    if _reconstructed_contents is None:
+        with _lock:
+            if _reconstructed_contents is None:
+                _reconstructed_contents = LRUCache(settings.DOCUMENT_DELTA_CACHE_MAX_BYTES)
+    return _reconstructed_contents
+
+
+def reset_reconstructed_contents():
+    global _reconstructed_contents
+    with _lock:
+        _reconstructed_contents = None
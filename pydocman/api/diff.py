@@ -0,0 +1,222 @@
+import bisect
+import json
+import re
+
+# Line diffs used for delta-encoded storage and for comparing versions.
+#
+# Sequences are first matched on their common prefix and suffix and on the
+# elements occurring exactly once in both (patience diff), which splits them
+# into small gaps at close to linear cost for the usual case of edited clauses
+# in a long document. Gaps without such anchors are compared with Myers'
+# algorithm. All of this is charged to a budget of max_work steps, and the
+# gaps left once it runs out are reported as replacements, so that the cost
+# stays bounded however large or unrelated the texts are.
+
+DEFAULT_MAX_WORK = 500000
+
+GRANULARITIES = {
+    'line': lambda text: text.splitlines(True),
+    # Whitespace runs are tokens of their own so that joining the tokens gives the text back
+    'word': lambda text: re.findall(r'\s+|\S+', text),
+}
+
+
+def diff_opcodes(a, b, max_work=DEFAULT_MAX_WORK):
+    # Returns difflib style (tag, i1, i2, j1, j2) opcodes turning sequence a into b
+    opcodes = []
+    i = j = 0
+    for block_i, block_j, size in _matching_blocks(a, b, max_work):
+        if i < block_i and j < block_j:
+            opcodes.append(('replace', i, block_i, j, block_j))
+        elif i < block_i:
+            opcodes.append(('delete', i, block_i, j, j))
+        elif j < block_j:
+            opcodes.append(('insert', i, i, j, block_j))
+        if size:
+            opcodes.append(('equal', block_i, block_i + size, block_j, block_j + size))
+        i, j = block_i + size, block_j + size
+    return opcodes
+
+
+def _matching_blocks(a, b, max_work):
+    # (i, j, size) runs of equal elements in increasing order, ending with an
+    # empty run at the end of both sequences
+    # Compare small integers rather than long strings in the inner loops
+    ids = {}
+    a = [ids.setdefault(element, len(ids)) for element in a]
+    b = [ids.setdefault(element, len(ids)) for element in b]
+
+    budget = [max_work]
+    matches = []
+    gaps = [(0, len(a), 0, len(b))]
+    while gaps:
+        alo, ahi, blo, bhi = gaps.pop()
+        prefix = 0
+        while alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]:
+            prefix += 1
+        if prefix:
+            matches.append((alo, blo, prefix))
+            alo, blo = alo + prefix, blo + prefix
+        suffix = 0
+        while alo < ahi - suffix and blo < bhi - suffix and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]:
+            suffix += 1
+        if suffix:
+            matches.append((ahi - suffix, bhi - suffix, suffix))
+            ahi, bhi = ahi - suffix, bhi - suffix
+        if alo == ahi or blo == bhi:
+            continue
+
+        budget[0] -= (ahi - alo) + (bhi - blo)
+        if budget[0] < 0:
+            continue
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            i, j = alo, blo
+            for anchor_i, anchor_j in anchors:
+                gaps.append((i, anchor_i, j, anchor_j))
+                matches.append((anchor_i, anchor_j, 1))
+                i, j = anchor_i + 1, anchor_j + 1
+            gaps.append((i, ahi, j, bhi))
+        else:
+            matches.extend(_myers(a, alo, ahi, b, blo, bhi, budget))
+
+    blocks = []
+    for i, j, size in sorted(matches):
+        if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += size
+        else:
+            blocks.append([i, j, size])
+    blocks.append([len(a), len(b), 0])
+    return blocks
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    # Pairs of positions of elements occurring once in each range, the longest
+    # list of them that is increasing in both sequences
+    positions_a = {}
+    for i in range(alo, ahi):
+        positions_a[a[i]] = i if a[i] not in positions_a else None
+    positions_b = {}
+    for j in range(blo, bhi):
+        if positions_a.get(b[j]) is not None:
+            positions_b[b[j]] = j if b[j] not in positions_b else None
+    pairs = sorted((positions_a[element], j) for element, j in positions_b.items() if j is not None)
+
+    # Longest increasing subsequence of the positions in b, by patience sorting
+    piles, tops, previous = [], [], {}
+    for i, j in pairs:
+        pile = bisect.bisect_left(tops, j)
+        previous[(i, j)] = piles[pile - 1] if pile else None
+        if pile == len(piles):
+            piles.append((i, j))
+            tops.append(j)
+        else:
+            piles[pile] = (i, j)
+            tops[pile] = j
+    anchors = []
+    pair = piles[-1] if piles else None
+    while pair is not None:
+        anchors.append(pair)
+        pair = previous[pair]
+    anchors.reverse()
+    return anchors
+
+
+def _myers(a, alo, ahi, b, blo, bhi, budget):
+    # Matches of Myers' shortest edit script between the ranges, or none once
+    # the budget is exhausted
+    n, m = ahi - alo, bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+            y = x - k
+            start = x
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x, y = x + 1, y + 1
+            budget[0] -= 1 + x - start
+            v[k] = x
+            if x >= n and y >= m:
+                return [(alo + i, blo + j, 1) for i, j in _backtrack(trace, n, m)]
+        if budget[0] < 0:
+            return []
+    return []
+
+
+def _backtrack(trace, x, y):
+    matches = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = v[previous_k]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            matches.append((x - 1, y - 1))
+            x, y = x - 1, y - 1
+        x, y = previous_x, previous_y
+    return matches
+
+
+def make_delta(base, content, max_work=DEFAULT_MAX_WORK):
+    # Serialises the line edits turning base into content
+    base_lines = base.splitlines(True)
+    lines = content.splitlines(True)
+    delta = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(base_lines, lines, max_work):
+        if tag == 'equal':
+            delta.append(['=', i2 - i1])
+            continue
+        if i2 > i1:
+            delta.append(['-', i2 - i1])
+        if j2 > j1:
+            delta.append(['+', lines[j1:j2]])
+    return json.dumps(delta, separators=(',', ':'))
+
+
+def apply_delta(base, delta):
+    base_lines = base.splitlines(True)
+    lines = []
+    position = 0
+    for op, value in json.loads(delta):
+        if op == '=':
+            lines.extend(base_lines[position:position + value])
+            position += value
+        elif op == '-':
+            position += value
+        else:
+            lines.extend(value)
+    return ''.join(lines)
+
+
+def diff_texts(base, content, granularity='line', max_work=DEFAULT_MAX_WORK):
+    # Describes the changes turning base into content. Unchanged runs only carry
+    # their length, changed runs the removed and added text. Past max_work, the
+    # remaining differences are coarse replacements rather than minimal edits.
+    split = GRANULARITIES[granularity]
+    base_tokens = split(base)
+    tokens = split(content)
+    changes = []
+    inserted = deleted = 0
+    for tag, i1, i2, j1, j2 in diff_opcodes(base_tokens, tokens, max_work):
+        if tag == 'equal':
+            changes.append({'op': tag, 'count': i2 - i1})
+            continue
+        changes.append({
+            'op': tag,
+            'base_start': i1,
+            'start': j1,
+            'removed': ''.join(base_tokens[i1:i2]),
+            'added': ''.join(tokens[j1:j2]),
+        })
+        deleted += i2 - i1
+        inserted += j2 - j1
+    return {'granularity': granularity, 'inserted': inserted, 'deleted': deleted, 'changes': changes}
@@ -0,0 +1,46 @@
+import threading
+
+from django.conf import settings
+
+_document_repository = None
+_lock = threading.Lock()
+
+
+def get_document_repository():
+    # Built on first use rather than at import time, so requests that never
+    # touch document bodies don't pay for importing boto3 or creating clients
+    global _document_repository
+    if _document_repository is None:
+        with _lock:
+            if _document_repository is None:
+                _document_repository = build_document_repository()
+    return _document_repository
+
+
+def reset_document_repository():
+    global _document_repository
+    with _lock:
+        _document_repository = None
+
+
+def build_document_repository():
+    backend = settings.DOCUMENT_REPOSITORY_BACKEND or ('local' if settings.ENV == 'local' else 's3')
+    if backend == 'local':
+        from .localdocumentrepository import LocalDocumentRepository
+        repository = LocalDocumentRepository(settings.BASE_DIR)
+    elif backend == 's3':
+        from .s3documentrepository import S3DocumentRepository
+        repository = S3DocumentRepository(settings.S3_BUCKET)
+    elif backend == 'memory':
+        from .memorydocumentrepository import MemoryDocumentRepository
+        repository = MemoryDocumentRepository(settings.DOCUMENT_REPOSITORY_SIMULATED_LATENCY)
+    else:
+        raise ValueError('Unknown document repository backend: {}'.format(backend))
+
+    if settings.DOCUMENT_CACHE_MAX_BYTES:
+        from .cacheddocumentrepository import CachedDocumentRepository
+        repository = CachedDocumentRepository(repository, settings.DOCUMENT_CACHE_MAX_BYTES)
+    if settings.INSTRUMENTATION_ENABLED:
+        from .instrumenteddocumentrepository import InstrumentedDocumentRepository
+        repository = InstrumentedDocumentRepository(repository)
+    return repository
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Thread-safe LRU mapping of keys to strings, bounded by the total encoded
+    # size of the values
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+class CachedDocumentRepository:
+    # Wraps another document repository with an in-process LRU cache of decoded
+    # contents. Stored contents are never modified after being written, so
+    # entries only leave the cache on eviction or when their key is written again.
+    def __init__(self, repository, max_bytes):
+        self.repository = repository
+        self.cache = LRUCache(max_bytes)
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    @property
+    def evictions(self):
+        return self.cache.evictions
+
+    def get(self, key, content_encoding=None):
+        content = self.cache.get(key)
+        if content is None:
+            content = self.repository.get(key, content_encoding)
+            self.cache.set(key, content)
+        return content
+
+    def put(self, key, content, content_encoding=None):
+        self.cache.invalidate(key)
+        self.repository.put(key, content, content_encoding)
+
+    def exists(self, key):
+        return key in self.cache or self.repository.exists(key)
+
+    def open_read(self, key):
+        return self.repository.open_read(key)
+
+    def open_write(self, key, content_type=None, content_encoding=None):
+        self.cache.invalidate(key)
+        return self.repository.open_write(key, content_type, content_encoding)
+
+    def presigned_url(self, key, method, expires_in, content_type=None, content_encoding=None):
+        if method == 'PUT':
+            self.cache.invalidate(key)
+        return self.repository.presigned_url(key, method, expires_in, content_type, content_encoding)
+
+    def invalidate(self, key):
+        self.cache.invalidate(key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,60 @@
+import gzip
+
+# Codecs applied to document bodies at rest. The codec name is recorded with
+# every stored object and doubles as its HTTP Content-Encoding, so bodies can be
+# handed to clients accepting that encoding without being decoded first.
+
+
+class IdentityCodec:
+    name = 'identity'
+    extension = ''
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def open_compress(self, fileobj):
+        return fileobj
+
+    def open_decompress(self, fileobj):
+        return fileobj
+
+
+class GzipCodec:
+    name = 'gzip'
+    extension = '.gz'
+
+    def __init__(self, compresslevel=6):
+        self.compresslevel = compresslevel
+
+    def compress(self, data):
+        return gzip.compress(data, self.compresslevel)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+    def open_compress(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=self.compresslevel)
+
+    def open_decompress(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+_codecs = {}
+
+
+def register_codec(codec):
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return _codecs[name or IdentityCodec.name]
+    except KeyError:
+        raise ValueError('Unknown document codec: {}'.format(name))
+
+
+register_codec(IdentityCodec())
+register_codec(GzipCodec())
@@ -0,0 +1,32 @@
+from api.instrumentation import span
+
+
+class InstrumentedDocumentRepository:
+    # Records the time requests spend waiting on another document repository.
+    # Bodies streamed from open_read or to open_write are only timed while opening.
+    def __init__(self, repository):
+        self.repository = repository
+
+    def get(self, key, content_encoding=None):
+        with span('storage'):
+            return self.repository.get(key, content_encoding)
+
+    def put(self, key, content, content_encoding=None):
+        with span('storage'):
+            self.repository.put(key, content, content_encoding)
+
+    def exists(self, key):
+        with span('storage'):
+            return self.repository.exists(key)
+
+    def open_read(self, key):
+        with span('storage'):
+            return self.repository.open_read(key)
+
+    def open_write(self, key, content_type=None, content_encoding=None):
+        with span('storage'):
+            return self.repository.open_write(key, content_type, content_encoding)
+
+    def __getattr__(self, name):
+        # stats(), clear() and the like of the wrapped repository
+        return getattr(self.repository, name)
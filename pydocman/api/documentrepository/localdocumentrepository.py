@@ -1,15 +1,95 @@
+import hashlib
 import os
+import tempfile
+
+from .codecs import get_codec
 
 class LocalDocumentRepository:
+    # Stores each key under two levels of subdirectories taken from the hash of
+    # the key, e.g. local/1-terms_0_1 in local/3f/a2/1-terms_0_1, so that no
+    # directory grows past a few thousand entries. Writes go to a temporary file
+    # that is renamed into place once synced, so readers never see partial bodies.
+    # Keys written before sharding are still read from their flat location.
     def __init__(self, directory):
         self.directory = directory
 
-    def get(self, filename):
-        fp = os.path.join(self.directory, filename)
-        with open(fp, 'r') as f:
-            return f.read()
-    
-    def put(self, filename, content):
-        fp = os.path.join(self.directory, filename)
-        with open(fp, 'w+') as f:
-            f.write(content)
\ No newline at end of file
+    def path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        prefix, name = os.path.split(key)
+        return os.path.join(self.directory, prefix, digest[:2], digest[2:4], name)
+
+    def legacy_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, content_encoding=None):
+        with self.open_read(key) as f:
+            return get_codec(content_encoding).decompress(f.read()).decode()
+
+    def put(self, key, content, content_encoding=None):
+        with self.open_write(key) as f:
+            f.write(get_codec(content_encoding).compress(content.encode()))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key)) or os.path.exists(self.legacy_path(key))
+
+    def open_read(self, key):
+        # A binary file object, which FileResponse can hand to the server's
+        # wsgi.file_wrapper to be sent without passing through Python
+        try:
+            return open(self.path(key), 'rb')
+        except FileNotFoundError:
+            return open(self.legacy_path(key), 'rb')
+
+    def open_write(self, key, content_type=None, content_encoding=None):
+        return AtomicFileWriter(self.path(key))
+
+    def presigned_url(self, key, method, expires_in, content_type=None, content_encoding=None):
+        # A signed URL of the transfer view, standing in for S3 presigned URLs
+        from api.transfer import signed_transfer_url
+        return signed_transfer_url(key, method, expires_in, content_type, content_encoding)
+
+
+class AtomicFileWriter:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temporary_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        # mkstemp creates files only the owner can read, unlike open()
+        os.chmod(self.temporary_path, 0o644)
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.temporary_path, self.path)
+        # The rename itself only survives a crash once the directory is synced
+        directory_fd = os.open(os.path.dirname(self.path), os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def abort(self):
+        if self.file.closed:
+            return
+        self.file.close()
+        os.unlink(self.temporary_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,65 @@
+import io
+import threading
+import time
+
+from .codecs import get_codec
+
+
+class MemoryDocumentRepository:
+    # Keeps stored bodies in process memory, waiting latency seconds on every
+    # call to stand in for a remote store in benchmarks
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, content_encoding=None):
+        return get_codec(content_encoding).decompress(self._read(key)).decode()
+
+    def put(self, key, content, content_encoding=None):
+        self._write(key, get_codec(content_encoding).compress(content.encode()))
+
+    def exists(self, key):
+        self._wait()
+        with self._lock:
+            return key in self.objects
+
+    def open_read(self, key):
+        return io.BytesIO(self._read(key))
+
+    def open_write(self, key, content_type=None, content_encoding=None):
+        return MemoryWriter(self, key)
+
+    def presigned_url(self, key, method, expires_in, content_type=None, content_encoding=None):
+        # A signed URL of the transfer view, standing in for S3 presigned URLs
+        from api.transfer import signed_transfer_url
+        return signed_transfer_url(key, method, expires_in, content_type, content_encoding)
+
+    def _read(self, key):
+        self._wait()
+        with self._lock:
+            try:
+                return self.objects[key]
+            except KeyError:
+                raise FileNotFoundError(key)
+
+    def _write(self, key, data):
+        self._wait()
+        with self._lock:
+            self.objects[key] = data
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class MemoryWriter(io.BytesIO):
+    def __init__(self, repository, key):
+        super().__init__()
+        self.repository = repository
+        self.key = key
+
+    def close(self):
+        if not self.closed:
+            self.repository._write(self.key, self.getvalue())
+        super().close()
@@ -1,19 +1,151 @@
-import boto3
+import threading
+
+from .codecs import get_codec
 
 class S3DocumentRepository:
     def __init__(self, s3_bucket):
-        self.s3_client = boto3.client('s3')
         self.s3_bucket = s3_bucket
+        self._s3_client = None
+        self._lock = threading.Lock()
 
-    def get(self, s3_bucket_key):
-        return self.s3_client.get_object(
+    @property
+    def s3_client(self):
+        # boto3 is slow to import and to build clients with, so both are deferred
+        # until the first call that needs S3
+        if self._s3_client is None:
+            with self._lock:
+                if self._s3_client is None:
+                    import boto3
+                    self._s3_client = boto3.client('s3')
+        return self._s3_client
+
+    def get(self, s3_bucket_key, content_encoding=None):
+        data = self.s3_client.get_object(
             Bucket=self.s3_bucket,
             Key=s3_bucket_key
-        )['Body'].read().decode()
+        )['Body'].read()
+        return get_codec(content_encoding).decompress(data).decode()
 
-    def put(self, s3_bucket_key, content):
+    def put(self, s3_bucket_key, content, content_encoding=None):
+        codec = get_codec(content_encoding)
         self.s3_client.put_object(
             Bucket=self.s3_bucket,
             Key=s3_bucket_key,
-            Body=content.encode()
-        )
\ No newline at end of file
+            Body=codec.compress(content.encode()),
+            **content_encoding_args(codec)
+        )
+
+    def exists(self, s3_bucket_key):
+        from botocore.exceptions import ClientError
+        try:
+            self.s3_client.head_object(Bucket=self.s3_bucket, Key=s3_bucket_key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+        return True
+
+    def open_read(self, s3_bucket_key):
+        return self.s3_client.get_object(
+            Bucket=self.s3_bucket,
+            Key=s3_bucket_key
+        )['Body']
+
+    def presigned_url(self, s3_bucket_key, method, expires_in, content_type=None, content_encoding=None):
+        # Lets clients transfer bodies with S3 directly. Uploads must send the
+        # same Content-Type header.
+        params = {'Bucket': self.s3_bucket, 'Key': s3_bucket_key}
+        if method == 'PUT':
+            if content_type:
+                params['ContentType'] = content_type
+            return self.s3_client.generate_presigned_url('put_object', Params=params, ExpiresIn=expires_in)
+        return self.s3_client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires_in)
+
+    def open_write(self, s3_bucket_key, content_type=None, content_encoding=None):
+        return S3MultipartWriter(
+            self.s3_client, self.s3_bucket, s3_bucket_key, content_type, get_codec(content_encoding)
+        )
+
+
+def content_encoding_args(codec):
+    # Recorded on the object so that S3 serves it with the matching header
+    if codec.name == 'identity':
+        return {}
+    return {'ContentEncoding': codec.name}
+
+
+class S3MultipartWriter:
+    # Buffers at most one part in memory. Bodies smaller than a part are sent
+    # with a single PUT, larger ones through a multipart upload.
+    part_size = 8 * 1024 * 1024
+
+    def __init__(self, s3_client, s3_bucket, s3_bucket_key, content_type=None, codec=None):
+        self.s3_client = s3_client
+        self.s3_bucket = s3_bucket
+        self.s3_bucket_key = s3_bucket_key
+        self.extra_args = content_encoding_args(codec or get_codec(None))
+        if content_type:
+            self.extra_args['ContentType'] = content_type
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def close(self):
+        if self.upload_id is None:
+            self.s3_client.put_object(
+                Bucket=self.s3_bucket,
+                Key=self.s3_bucket_key,
+                Body=bytes(self.buffer),
+                **self.extra_args
+            )
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_bucket_key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+        self.buffer = bytearray()
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_bucket_key,
+                UploadId=self.upload_id
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _upload_part(self, data):
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.s3_bucket,
+                Key=self.s3_bucket_key,
+                **self.extra_args
+            )['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.s3_bucket,
+            Key=self.s3_bucket_key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
\ No newline at end of file
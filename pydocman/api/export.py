@@ -0,0 +1,191 @@
+import io
+import json
+import mimetypes
+import tarfile
+import tempfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from api.serializers import DocumentSerializer
+
+# Archives of document bodies with a manifest.json of their metadata, produced
+# as a stream of chunks. Bodies are read a bounded number of documents ahead of
+# the one being written and the manifest is spooled to a temporary file and
+# copied into the archive in chunks, so memory use does not depend on the
+# number of documents.
+
+ARCHIVE_CONTENT_TYPES = {
+    'zip': 'application/zip',
+    'tar': 'application/x-tar',
+}
+EXTENSIONS = {'text/plain': '.txt'}
+
+
+def export_documents(documents, archive_format='zip'):
+    # documents is iterated once, with select_related('lender_document') applied
+    # so that paths can be built without further queries
+    output = _ChunkWriter()
+    archive = ZipArchive(output) if archive_format == 'zip' else TarArchive(output)
+    with tempfile.TemporaryFile() as manifest:
+        manifest.write(b'[')
+        for i, (document, body) in enumerate(read_ahead(documents)):
+            data = DocumentSerializer(document, many=False).data
+            data['lender_document_id'] = document.lender_document_id
+            if body is None:
+                data['error_msg'] = 'Could not retrieve content.'
+            else:
+                data['path'] = document_path(document)
+                archive.add(data['path'], body, document.created_at.timestamp())
+            manifest.write((',\n' if i else '\n').encode() + json.dumps(data, default=str).encode())
+            chunk = output.take()
+            if chunk:
+                yield chunk
+        manifest.write(b'\n]\n')
+        size = manifest.tell()
+        manifest.seek(0)
+        with archive.open('manifest.json', size, None) as f:
+            for data in iter(lambda: manifest.read(settings.DOCUMENT_STREAM_CHUNK_SIZE), b''):
+                f.write(data)
+                chunk = output.take()
+                if chunk:
+                    yield chunk
+    archive.close()
+    yield output.take()
+
+
+def read_ahead(documents):
+    # Yields (document, body) pairs in order, with up to DOCUMENT_EXPORT_READ_AHEAD
+    # bodies being fetched concurrently. The body is None when it could not be read.
+    with ThreadPoolExecutor(max_workers=settings.DOCUMENT_FETCH_MAX_WORKERS) as executor:
+        pending = deque()
+        for document in documents:
+            document.prepare_content()
+            pending.append((document, executor.submit(read_body, document)))
+            if len(pending) >= settings.DOCUMENT_EXPORT_READ_AHEAD:
+                yield _result(*pending.popleft())
+        while pending:
+            yield _result(*pending.popleft())
+
+
+def read_body(document):
+    f = document.open_content()
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _result(document, future):
+    try:
+        return document, future.result()
+    except Exception:
+        return document, None
+
+
+def document_path(document):
+    extension = EXTENSIONS.get(document.content_type) or mimetypes.guess_extension(document.content_type) or ''
+    return '{}-{}/{}.{}-{}{}'.format(
+        document.lender_document_id,
+        document.lender_document.name.replace(' ', '').lower(),
+        document.version_major,
+        document.version_minor,
+        document.document_id,
+        extension
+    )
+
+
+class ZipArchive:
+    def __init__(self, fileobj):
+        self.zip_file = zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED)
+
+    def add(self, name, data, mtime):
+        info = zipfile.ZipInfo(name, time.gmtime(mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self.zip_file.writestr(info, data)
+
+    def open(self, name, size, mtime):
+        # A file to write a member of the given size to in parts
+        info = zipfile.ZipInfo(name, time.gmtime(mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.file_size = size
+        return self.zip_file.open(info, 'w')
+
+    def close(self):
+        self.zip_file.close()
+
+
+class TarArchive:
+    def __init__(self, fileobj):
+        self.tar_file = tarfile.open(fileobj=fileobj, mode='w|')
+
+    def add(self, name, data, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime or time.time()
+        self.tar_file.addfile(info, io.BytesIO(data))
+
+    def open(self, name, size, mtime):
+        # A file to write a member of the given size to in parts
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = mtime or time.time()
+        return _TarMemberWriter(self.tar_file, info)
+
+    def close(self):
+        self.tar_file.close()
+
+
+class _TarMemberWriter:
+    # Writes the header, then the data as it comes, then the padding, as
+    # TarFile.addfile does when copying from a file
+    def __init__(self, tar_file, info):
+        self.tar_file = tar_file
+        self.info = info
+        header = info.tobuf(tar_file.format, tar_file.encoding, tar_file.errors)
+        tar_file.fileobj.write(header)
+        tar_file.offset += len(header)
+        self.written = 0
+
+    def write(self, data):
+        self.tar_file.fileobj.write(data)
+        self.written += len(data)
+        return len(data)
+
+    def close(self):
+        if self.written != self.info.size:
+            raise tarfile.StreamError('{} is {} bytes, not {}'.format(self.info.name, self.written, self.info.size))
+        blocks, remainder = divmod(self.info.size, tarfile.BLOCKSIZE)
+        if remainder:
+            self.tar_file.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.tar_file.offset += blocks * tarfile.BLOCKSIZE
+        self.tar_file.members.append(self.info)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.close()
+
+
+class _ChunkWriter:
+    # Write-only file collecting what the archive writes until it is taken
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
@@ -0,0 +1,74 @@
+# Records how long each module takes to import. Run as
+# `python -m api.importprofile <module> <output file>` in a fresh interpreter so
+# that nothing has been imported yet; used by `manage.py importtime`.
+import json
+import sys
+import time
+
+
+class TimingLoader:
+    def __init__(self, loader, records, stack):
+        self.loader = loader
+        self.records = records
+        self.stack = stack
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            self.records.append({
+                'module': module.__name__,
+                'self_ms': (elapsed - nested) * 1000,
+                'cumulative_ms': elapsed * 1000,
+            })
+
+
+class TimingFinder:
+    def __init__(self):
+        self.records = []
+        self.stack = []
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if hasattr(spec.loader, 'exec_module'):
+                spec.loader = TimingLoader(spec.loader, self.records, self.stack)
+            return spec
+        return None
+
+
+def profile(module_name):
+    finder = TimingFinder()
+    sys.meta_path.insert(0, finder)
+    started = time.perf_counter()
+    try:
+        __import__(module_name)
+    finally:
+        sys.meta_path.remove(finder)
+    return {
+        'module': module_name,
+        'total_ms': (time.perf_counter() - started) * 1000,
+        'imports': finder.records,
+    }
+
+
+if __name__ == '__main__':
+    result = profile(sys.argv[1])
+    with open(sys.argv[2], 'w') as f:
+        json.dump(result, f)
@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django import http
+from rest_framework import renderers
+
+# Per-request timing of database queries, document repository calls,
+# serialization and response rendering. Spans are only recorded on the thread
+# handling a request while InstrumentationMiddleware is active, and cost two
+# clock reads each.
+
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_state = threading.local()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        span = self.spans.get(name)
+        if span is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            span[0] += seconds
+            span[1] += 1
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed with connection.execute_wrapper to time queries
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - started)
+
+
+def current_timings():
+    return getattr(_state, 'timings', None)
+
+
+@contextmanager
+def request_timings():
+    timings = _state.timings = RequestTimings()
+    try:
+        yield timings
+    finally:
+        _state.timings = None
+
+
+@contextmanager
+def span(name):
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def server_timing(timings, total):
+    metrics = ['{};dur={:.1f};desc="{}"'.format(name, seconds * 1000, count) for name, (seconds, count) in sorted(timings.spans.items())]
+    metrics.append('total;dur={:.1f}'.format(total * 1000))
+    return ', '.join(metrics)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def as_dict(self):
+        buckets = {str(le): count for le, count in zip(BUCKETS_MS, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {'count': self.count, 'sum_ms': self.sum_ms, 'buckets': buckets}
+
+
+class Metrics:
+    # Histograms of request and span durations by endpoint, for this process
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, timings, total):
+        with self._lock:
+            histograms = self._endpoints.setdefault(endpoint, {})
+            histograms.setdefault('total', Histogram()).observe(total * 1000)
+            for name, (seconds, _) in timings.spans.items():
+                histograms.setdefault(name, Histogram()).observe(seconds * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {name: histogram.as_dict() for name, histogram in histograms.items()}
+                for endpoint, histograms in self._endpoints.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+metrics = Metrics()
+
+
+def log_record(endpoint, status_code, timings, total):
+    return json.dumps({
+        'endpoint': endpoint,
+        'status': status_code,
+        'total_ms': round(total * 1000, 2),
+        'spans': {name: {'ms': round(seconds * 1000, 2), 'count': count} for name, (seconds, count) in timings.spans.items()},
+    }, sort_keys=True)
+
+
+class JsonResponse(http.JsonResponse):
+    # Times the encoding of the body, which happens when the response is built
+    def __init__(self, *args, **kwargs):
+        with span('render'):
+            super().__init__(*args, **kwargs)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('render'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -0,0 +1,64 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import ENDPOINTS, benchmark_environment, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the document endpoints against seeded data in a throwaway test database, '
+        'with document bodies kept in memory behind a simulated latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lenders', type=int, default=20)
+        parser.add_argument('--document-types', type=int, default=5, help='Per lender')
+        parser.add_argument('--versions', type=int, default=50, help='Per document type')
+        parser.add_argument('--lines', type=int, default=200, help='Per document')
+        parser.add_argument('--requests', type=int, default=200, help='Per endpoint')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per endpoint')
+        parser.add_argument('--latency-ms', type=float, default=20, help='Simulated latency of each repository call')
+        parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--json', action='store_true', help='Write the results as JSON to standard output')
+
+    def handle(self, *args, **options):
+        endpoints = [e.strip() for e in options['endpoints'].split(',') if e.strip()]
+        unknown = set(endpoints) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError('Unknown endpoints: {}'.format(', '.join(sorted(unknown))))
+
+        with benchmark_environment():
+            result = run_benchmark(
+                lenders=options['lenders'],
+                document_types=options['document_types'],
+                versions=options['versions'],
+                lines=options['lines'],
+                requests=options['requests'],
+                warmup=options['warmup'],
+                latency=options['latency_ms'] / 1000,
+                endpoints=endpoints,
+                seed=options['seed'],
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(result, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write('Seeded {} lenders x {} document types x {} versions in {:.1f} s\n'.format(
+            options['lenders'], options['document_types'], options['versions'], result['seed_seconds']
+        ))
+        self.stdout.write('{:<10}  {:>8}  {:>8}  {:>8}  {:>8}  {:>9}  {}'.format(
+            'endpoint', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'queries', 'statuses'
+        ))
+        for endpoint, measurement in result['endpoints'].items():
+            latency = measurement['latency_ms']
+            self.stdout.write('{:<10}  {:>8.1f}  {:>8.2f}  {:>8.2f}  {:>8.2f}  {:>9.1f}  {}'.format(
+                endpoint, measurement['throughput_rps'], latency['p50'], latency['p95'], latency['p99'],
+                measurement['queries']['mean'], json.dumps(measurement['statuses'])
+            ))
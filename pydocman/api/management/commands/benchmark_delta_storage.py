@@ -0,0 +1,101 @@
+import json
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.benchmark import random_line
+from api.diff import apply_delta, make_delta
+from api.documentrepository.codecs import get_codec
+
+
+class Command(BaseCommand):
+    help = 'Compares storage size and read latency of full copies and delta-encoded versions on synthetic edits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--versions', type=int, default=200)
+        parser.add_argument('--lines', type=int, default=2000, help='Lines in the first version')
+        parser.add_argument('--edits', type=int, default=3, help='Lines changed between versions')
+        parser.add_argument('--interval', type=int, action='append', help='Snapshot interval, may be repeated')
+        parser.add_argument('--fetch-latency-ms', type=float, default=0, help='Simulated latency of each stored object read')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Write the raw measurements as JSON')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        versions = generate_versions(rng, options['versions'], options['lines'], options['edits'])
+        codec = get_codec(settings.DOCUMENT_COMPRESSION)
+        fetch_latency = options['fetch_latency_ms'] / 1000
+
+        results = [measure(versions, 1, codec, fetch_latency)]
+        for interval in options['interval'] or [10, 50]:
+            results.append(measure(versions, interval, codec, fetch_latency))
+
+        if options['json']:
+            self.stdout.write(json.dumps({'codec': codec.name, 'versions': len(versions), 'results': results}, indent=2))
+            return
+
+        self.stdout.write('{} versions of {} lines, {} lines changed per version, {} codec\n'.format(
+            len(versions), options['lines'], options['edits'], codec.name
+        ))
+        self.stdout.write('{:>10}  {:>14}  {:>8}  {:>10}  {:>10}'.format('interval', 'stored bytes', 'ratio', 'mean ms', 'p95 ms'))
+        full_bytes = results[0]['stored_bytes']
+        for result in results:
+            self.stdout.write('{:>10}  {:>14}  {:>8.3f}  {:>10.2f}  {:>10.2f}'.format(
+                'full' if result['interval'] == 1 else result['interval'],
+                result['stored_bytes'], result['stored_bytes'] / full_bytes,
+                result['read_ms_mean'], result['read_ms_p95']
+            ))
+
+
+def generate_versions(rng, count, lines, edits):
+    content = [random_line(rng) for _ in range(lines)]
+    versions = [''.join(content)]
+    for _ in range(count - 1):
+        for _ in range(edits):
+            position = rng.randrange(len(content))
+            action = rng.random()
+            if action < 0.6:
+                content[position] = random_line(rng)
+            elif action < 0.8 or len(content) < 2:
+                content.insert(position, random_line(rng))
+            else:
+                del content[position]
+        versions.append(''.join(content))
+    return versions
+
+
+def measure(versions, interval, codec, fetch_latency):
+    # Stores every version as Document.create would with the given snapshot
+    # interval, then reads each back without any cache, the worst case of a read
+    stored = []
+    for i, content in enumerate(versions):
+        is_delta = i % interval != 0
+        body = make_delta(versions[i - 1], content) if is_delta else content
+        if is_delta and len(body) >= len(content):
+            body, is_delta = content, False
+        stored.append((is_delta, codec.compress(body.encode())))
+
+    latencies = []
+    for i, content in enumerate(versions):
+        started = time.perf_counter()
+        chain = [i]
+        while stored[chain[-1]][0]:
+            chain.append(chain[-1] - 1)
+        rebuilt = None
+        for j in reversed(chain):
+            if fetch_latency:
+                time.sleep(fetch_latency)
+            body = codec.decompress(stored[j][1]).decode()
+            rebuilt = apply_delta(rebuilt, body) if stored[j][0] else body
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert rebuilt == content
+
+    latencies.sort()
+    return {
+        'interval': interval,
+        'stored_bytes': sum(len(body) for _, body in stored),
+        'read_ms_mean': sum(latencies) / len(latencies),
+        'read_ms_p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.benchmark import benchmark_environment, run_serializer_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Compares list serialization through model serializers and through .values() rows, in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Documents to serialize')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per path, the fastest is reported')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help='Write the results as JSON')
+
+    def handle(self, *args, **options):
+        with benchmark_environment():
+            result = run_serializer_benchmark(options['rows'], options['repeat'], options['seed'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+        # ms per 1000 rows, for serialization alone and including the query
+        self.stdout.write('{:<16}  {:>6}  {:>10}  {:>10}  {:>8}  {:>10}  {:>10}  {:>8}'.format(
+            'serializer', 'rows', 'model', 'values', 'speedup', 'model+db', 'values+db', 'speedup'
+        ))
+        for name, measurement in result['serializers'].items():
+            self.stdout.write('{:<16}  {:>6}  {:>10.2f}  {:>10.2f}  {:>7.1f}x  {:>10.2f}  {:>10.2f}  {:>7.1f}x'.format(
+                name, measurement['rows'],
+                measurement['model_serialize_ms_per_1000'], measurement['values_serialize_ms_per_1000'],
+                measurement['serialize_speedup'],
+                measurement['model_ms_per_1000'], measurement['values_ms_per_1000'], measurement['speedup'],
+            ))
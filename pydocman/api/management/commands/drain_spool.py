@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.writebehind import drain_spool
+
+
+class Command(BaseCommand):
+    help = 'Uploads document bodies spooled by write-behind creation to the document repository'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--retries', type=int, default=None, help='Defaults to DOCUMENT_WRITE_BEHIND_RETRIES')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when the spool is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no more bodies can be uploaded')
+
+    def handle(self, *args, **options):
+        while True:
+            uploaded, failed = drain_spool(options['batch_size'], options['retries'])
+            if uploaded or failed:
+                self.stdout.write('Uploaded {} bodies, {} failed'.format(uploaded, failed))
+            if uploaded:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from api.export import ARCHIVE_CONTENT_TYPES, export_documents
+from api.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Writes an archive of document bodies with a manifest.json of their metadata'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Archive path, or - for standard output')
+        parser.add_argument('--lender', type=int, help='Only export documents of this lender')
+        parser.add_argument('--type', type=int, help='Only export documents of this lender document')
+        parser.add_argument('--active-only', action='store_true')
+        parser.add_argument('--archive', choices=sorted(ARCHIVE_CONTENT_TYPES), default='zip')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.select_related('created_by', 'lender_document')
+        if options['lender'] is not None:
+            documents = documents.filter(lender_id=options['lender'])
+        if options['type'] is not None:
+            documents = documents.filter(lender_document_id=options['type'])
+        if options['active_only']:
+            documents = documents.filter(lender_document__active_document_id=F('document_id'))
+        documents = documents.order_by('lender_document_id', 'version_major', 'version_minor', 'document_id')
+
+        if options['output'] == '-':
+            write_archive(documents, options['archive'], sys.stdout.buffer)
+            return
+        try:
+            with open(options['output'], 'wb') as output:
+                size = write_archive(documents, options['archive'], output)
+        except OSError as e:
+            raise CommandError(e)
+        self.stdout.write('Wrote {} bytes to {}'.format(size, options['output']))
+
+
+def write_archive(documents, archive_format, output):
+    size = 0
+    for chunk in export_documents(documents.iterator(), archive_format):
+        output.write(chunk)
+        size += len(chunk)
+    return size
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import mimetypes
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.documentrepository import get_document_repository
+from api.documentrepository.codecs import get_codec
+from api.models import Document, LenderDocument
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports document versions from a directory of <lender_document_id>/<file> entries, '
+        'or from a JSON lines manifest of {"path", "lender_document_id", "content_type", '
+        '"created_at", "created_by"} objects, in order'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory or .jsonl manifest')
+        parser.add_argument('--user', help='Username recorded as the creator when the manifest has none')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent uploads')
+        parser.add_argument('--progress-file', help='Defaults to <source>.progress')
+        parser.add_argument('--restart', action='store_true', help='Ignore recorded progress')
+
+    def handle(self, *args, **options):
+        source = options['source'].rstrip(os.sep)
+        if not os.path.exists(source):
+            raise CommandError('{} does not exist'.format(source))
+        progress_file = options['progress_file'] or source + '.progress'
+        completed = 0 if options['restart'] else read_progress(progress_file)
+        users = UserCache(options['user'])
+
+        entries = read_directory(source) if os.path.isdir(source) else read_manifest(source)
+        imported = uploaded_bytes = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            batch = []
+            for index, entry in enumerate(entries):
+                if index < completed:
+                    continue
+                batch.append(entry)
+                if len(batch) == options['batch_size']:
+                    uploaded_bytes += self.import_batch(batch, executor, users, progress_file, completed + imported)
+                    imported += len(batch)
+                    self.report(imported, uploaded_bytes, started)
+                    batch = []
+            if batch:
+                uploaded_bytes += self.import_batch(batch, executor, users, progress_file, completed + imported)
+                imported += len(batch)
+        self.report(imported, uploaded_bytes, started)
+        if completed:
+            self.stdout.write('Skipped {} entries imported by a previous run'.format(completed))
+        if settings.DOCUMENT_SEARCH_INDEX:
+            self.stdout.write('Run `manage.py index_documents` to add the imported documents to the search index')
+
+    def import_batch(self, batch, executor, users, progress_file, completed):
+        lender_documents = LenderDocument.objects.in_bulk({entry['lender_document_id'] for entry in batch})
+        by_lender_document = defaultdict(list)
+        for entry in batch:
+            if entry['lender_document_id'] not in lender_documents:
+                raise CommandError('Unknown lender document {} for {}'.format(entry['lender_document_id'], entry['path']))
+            by_lender_document[entry['lender_document_id']].append(entry)
+
+        # Versions are reserved before uploading, since they are part of the
+        # keys. A failed batch leaves a gap in the version numbers, nothing more.
+        for lender_document_id, entries in by_lender_document.items():
+            lender_document = lender_documents[lender_document_id]
+            for entry, version in zip(entries, lender_document.allocate_versions(len(entries))):
+                entry['lender_document'] = lender_document
+                entry['version_major'], entry['version_minor'] = version
+
+        stored = list(executor.map(store_body, batch))
+        # The batch is recorded as pending before it is committed, so a run
+        # interrupted between the commit and the progress update can tell
+        # whether it was inserted instead of inserting it again
+        with transaction.atomic():
+            Document.objects.bulk_create([
+                Document(
+                    s3_bucket=settings.S3_BUCKET,
+                    s3_bucket_key=s3_bucket_key,
+                    content_digest=content_digest,
+                    content_type=entry['content_type'],
+                    content_encoding=content_encoding,
+                    created_at=entry['created_at'],
+                    created_by=users.get(entry['created_by']),
+                    version_major=entry['version_major'],
+                    version_minor=entry['version_minor'],
+                    lender_document=entry['lender_document'],
+                    lender_id=entry['lender_document'].lender_id,
+                )
+                for entry, (s3_bucket_key, content_digest, content_encoding, _) in zip(batch, stored)
+            ], batch_size=500)
+            write_progress(progress_file, completed, pending=[
+                [entry['lender_document'].pk, entry['version_major'], entry['version_minor']] for entry in batch
+            ])
+        write_progress(progress_file, completed + len(batch))
+        return sum(size for _, _, _, size in stored)
+
+    def report(self, imported, uploaded_bytes, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write('Imported {} documents ({:.1f} MB) in {:.1f} s, {:.1f} documents/s'.format(
+            imported, uploaded_bytes / 1024 / 1024, elapsed, imported / elapsed if elapsed else 0
+        ))
+
+
+def store_body(entry):
+    # Runs in the upload pool. Stores the body as Document.create would,
+    # except that versions are never delta encoded.
+    with open(entry['path'], 'rb') as f:
+        data = f.read()
+    content_digest = hashlib.sha256(data).hexdigest()
+    is_text = entry['content_type'].startswith('text/')
+    codec = get_codec(settings.DOCUMENT_COMPRESSION if is_text else None)
+    document_repository = get_document_repository()
+    if is_text and settings.DOCUMENT_CONTENT_ADDRESSED:
+        s3_bucket_key = Document.content_addressed_key(content_digest, codec.name)
+        if document_repository.exists(s3_bucket_key):
+            return s3_bucket_key, content_digest, codec.name, 0
+    else:
+        s3_bucket_key = Document.versioned_key(entry['lender_document'], entry['version_major'], entry['version_minor'])
+    data = codec.compress(data)
+    with document_repository.open_write(s3_bucket_key, entry['content_type'], codec.name) as f:
+        f.write(data)
+    return s3_bucket_key, content_digest, codec.name, len(data)
+
+
+def read_directory(directory):
+    for name in sorted(os.listdir(directory), key=lambda name: (len(name), name)):
+        lender_directory = os.path.join(directory, name)
+        if not os.path.isdir(lender_directory):
+            continue
+        for filename in sorted(os.listdir(lender_directory)):
+            yield make_entry({'lender_document_id': name, 'path': os.path.join(lender_directory, filename)})
+
+
+def read_manifest(manifest):
+    directory = os.path.dirname(os.path.abspath(manifest))
+    with open(manifest) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry['path'] = os.path.join(directory, entry['path'])
+                yield make_entry(entry)
+
+
+def make_entry(entry):
+    try:
+        lender_document_id = int(entry['lender_document_id'])
+    except (KeyError, ValueError):
+        raise CommandError('Invalid lender document for {}'.format(entry.get('path')))
+    created_at = parse_datetime(entry['created_at']) if entry.get('created_at') else None
+    return {
+        'path': entry['path'],
+        'lender_document_id': lender_document_id,
+        'content_type': entry.get('content_type') or mimetypes.guess_type(entry['path'])[0] or 'application/octet-stream',
+        'created_at': created_at or timezone.now(),
+        'created_by': entry.get('created_by'),
+    }
+
+
+def read_progress(progress_file):
+    try:
+        with open(progress_file) as f:
+            progress = json.load(f)
+    except FileNotFoundError:
+        return 0
+    completed = progress['completed']
+    pending = progress.get('pending')
+    # Batches are inserted in one transaction, so any of their versions tells
+    # whether the pending batch was committed
+    if pending and Document.objects.filter(
+        lender_document_id=pending[0][0], version_major=pending[0][1], version_minor=pending[0][2]
+    ).exists():
+        completed += len(pending)
+    return completed
+
+
+def write_progress(progress_file, completed, pending=None):
+    # Replaced atomically
+    with open(progress_file + '.tmp', 'w') as f:
+        json.dump({'completed': completed, 'pending': pending}, f)
+    os.replace(progress_file + '.tmp', progress_file)
+
+
+class UserCache:
+    def __init__(self, default_username):
+        self.default_username = default_username
+        self.users = {}
+
+    def get(self, username):
+        username = username or self.default_username
+        if username is None:
+            return None
+        if username not in self.users:
+            try:
+                self.users[username] = User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError('Unknown user {}'.format(username))
+        return self.users[username]
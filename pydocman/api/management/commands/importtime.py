@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Reports an import time breakdown of a module, by default the WSGI application, in a fresh interpreter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='pydocman.wsgi')
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--json', action='store_true', help='Write the raw measurements as JSON')
+
+    def handle(self, *args, **options):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            process = subprocess.run(
+                [sys.executable, '-m', 'api.importprofile', options['module'], output.name],
+                cwd=settings.BASE_DIR,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            if process.returncode != 0:
+                raise CommandError(process.stderr.decode())
+            with open(output.name) as f:
+                result = json.load(f)
+
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        by_package = defaultdict(float)
+        for record in result['imports']:
+            by_package[record['module'].split('.')[0]] += record['self_ms']
+
+        self.stdout.write('Importing {} took {:.1f} ms ({} modules)\n'.format(
+            result['module'], result['total_ms'], len(result['imports'])
+        ))
+        self.stdout.write('{:>10}  {}'.format('self ms', 'top-level package'))
+        for package, self_ms in sorted(by_package.items(), key=lambda p: -p[1])[:options['limit']]:
+            self.stdout.write('{:>10.1f}  {}'.format(self_ms, package))
+
+        self.stdout.write('\n{:>10}  {:>10}  {}'.format('cumul. ms', 'self ms', 'module'))
+        slowest = sorted(result['imports'], key=lambda r: -r['cumulative_ms'])[:options['limit']]
+        for record in slowest:
+            self.stdout.write('{:>10.1f}  {:>10.1f}  {}'.format(
+                record['cumulative_ms'], record['self_ms'], record['module']
+            ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Document
+from api.search import index_document, uses_full_text_search
+
+
+class Command(BaseCommand):
+    help = 'Adds the contents of existing text documents to the search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--reindex', action='store_true', help='Index documents that are indexed already too')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(content_type__startswith='text/').order_by('document_id')
+        if not options['reindex']:
+            if uses_full_text_search():
+                documents = documents.filter(search_vector__isnull=True)
+            else:
+                documents = documents.filter(terms__isnull=True)
+        indexed = failed = 0
+        last_document_id = 0
+        while True:
+            batch = list(documents.filter(document_id__gt=last_document_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_document_id = batch[-1].document_id
+            contents, errors = Document.get_contents(batch)
+            for document in batch:
+                if document.document_id in errors:
+                    self.stderr.write('Could not read document {}: {}'.format(
+                        document.document_id, errors[document.document_id]
+                    ))
+                    failed += 1
+                    continue
+                index_document(document, contents[document.document_id])
+                indexed += 1
+        self.stdout.write('Indexed {} documents, {} failed'.format(indexed, failed))
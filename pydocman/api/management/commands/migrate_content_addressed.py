@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from api.documentrepository import get_document_repository
+from api.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Moves document bodies stored under per-version keys to content-addressed keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        legacy_keys = (
+            Document.objects.filter(
+                content_type__startswith='text/', delta_base__isnull=True, storage_state=Document.STORED
+            )
+            .exclude(s3_bucket_key__startswith=Document.content_addressed_key(''))
+            .order_by('s3_bucket_key')
+            .values_list('s3_bucket_key', 'content_encoding')
+            .distinct()
+        )
+        document_repository = get_document_repository()
+        migrated = uploaded = 0
+        last_key = ''
+        while True:
+            batch = list(legacy_keys.filter(s3_bucket_key__gt=last_key)[:options['batch_size']])
+            if not batch:
+                break
+            last_key = batch[-1][0]
+            for s3_bucket_key, content_encoding in batch:
+                content = document_repository.get(s3_bucket_key, content_encoding)
+                content_digest = Document.digest(content)
+                content_addressed_key = Document.content_addressed_key(content_digest, content_encoding)
+                if options['dry_run']:
+                    self.stdout.write('{} -> {}'.format(s3_bucket_key, content_addressed_key))
+                    continue
+                if not document_repository.exists(content_addressed_key):
+                    document_repository.put(content_addressed_key, content, content_encoding)
+                    uploaded += 1
+                # The legacy object is left in place so that rolling back stays possible
+                migrated += Document.objects.filter(s3_bucket_key=s3_bucket_key).update(
+                    s3_bucket_key=content_addressed_key,
+                    content_digest=content_digest
+                )
+        self.stdout.write('Migrated {} documents, uploaded {} bodies'.format(migrated, uploaded))
@@ -0,0 +1,58 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .instrumentation import log_record, metrics, request_timings, server_timing
+from .querybudget import QueryBudgetExceeded, count_queries
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetMiddleware:
+    # Logs requests running more than settings.QUERY_BUDGET queries, or fails
+    # them when settings.QUERY_BUDGET_STRICT is set
+    def __init__(self, get_response):
+        if settings.QUERY_BUDGET is None:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with count_queries() as counter:
+            response = self.get_response(request)
+        if counter.count > settings.QUERY_BUDGET:
+            message = '{} {} executed {} queries, budget is {}'.format(
+                request.method, request.path, counter.count, settings.QUERY_BUDGET
+            )
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class InstrumentationMiddleware:
+    # Times each request's queries, repository calls, serialization and
+    # rendering, adds them to the per-endpoint histograms served by the metrics
+    # endpoint and reports them in a Server-Timing header and, optionally, a log line
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with request_timings() as timings, ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timings))
+            response = self.get_response(request)
+        total = timings.total()
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        endpoint = '{} {}'.format(request.method, resolver_match.view_name if resolver_match else 'unmatched')
+        metrics.record(endpoint, timings, total)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(timings, total)
+        if settings.INSTRUMENTATION_LOG:
+            logger.info(log_record(endpoint, response.status_code, timings, total))
+        return response
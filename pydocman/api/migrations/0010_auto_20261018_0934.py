@@ -0,0 +1,25 @@
+# Generated by Django 2.0.1 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_auto_20180117_1728'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['created_at', 'document_id'], name='document_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['lender_document', 'created_at', 'document_id'], name='document_type_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['lender_document', 'version_minor', 'created_at'], name='document_published_idx'),
+        ),
+    ]
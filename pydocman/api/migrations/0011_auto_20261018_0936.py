@@ -0,0 +1,73 @@
+# Generated by Django 2.0.1 on 2026-10-18 09:36
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def renumber_duplicate_versions(Document):
+    # Versions drafted concurrently before allocation was serialised can share a
+    # number. All but one of each are moved to new minor versions after the
+    # latest of their major version, the active version keeping its number.
+    duplicates = list(
+        Document.objects.values('lender_document_id', 'version_major', 'version_minor')
+        .annotate(count=Count('document_id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        documents = list(
+            Document.objects.filter(
+                lender_document_id=duplicate['lender_document_id'],
+                version_major=duplicate['version_major'],
+                version_minor=duplicate['version_minor'],
+            ).select_related('lender_document').order_by('document_id')
+        )
+        documents.sort(key=lambda document: document.lender_document.active_document_id != document.document_id)
+        latest_minor = Document.objects.filter(
+            lender_document_id=duplicate['lender_document_id'],
+            version_major=duplicate['version_major'],
+        ).aggregate(v=Max('version_minor'))['v']
+        for document in documents[1:]:
+            latest_minor += 1
+            document.version_minor = latest_minor
+            document.save(update_fields=['version_minor'])
+
+
+def backfill_version_counters(apps, schema_editor):
+    LenderDocument = apps.get_model('api', 'LenderDocument')
+    Document = apps.get_model('api', 'Document')
+    renumber_duplicate_versions(Document)
+    for lender_document in LenderDocument.objects.all():
+        documents = Document.objects.filter(lender_document=lender_document)
+        version_major = documents.aggregate(v=Max('version_major'))['v']
+        if version_major is None:
+            continue
+        lender_document.latest_version_major = version_major
+        lender_document.latest_version_minor = documents.filter(
+            version_major=version_major
+        ).aggregate(v=Max('version_minor'))['v']
+        lender_document.save(update_fields=['latest_version_major', 'latest_version_minor'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_auto_20261018_0934'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lenderdocument',
+            name='latest_version_major',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lenderdocument',
+            name='latest_version_minor',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_version_counters, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='document',
+            unique_together={('lender_document', 'version_major', 'version_minor')},
+        ),
+    ]
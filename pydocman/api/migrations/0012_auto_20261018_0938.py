@@ -0,0 +1,23 @@
+# Generated by Django 2.0.1 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_auto_20261018_0936'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_digest',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='s3_bucket_key',
+            field=models.CharField(max_length=100),
+        ),
+    ]
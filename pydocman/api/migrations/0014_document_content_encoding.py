@@ -0,0 +1,18 @@
+# Generated by Django 2.0.1 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_document_content_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_encoding',
+            field=models.CharField(default='identity', max_length=20),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.0.1 on 2026-10-18 09:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_document_content_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='delta_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='api.Document'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='delta_depth',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.0.1 on 2026-10-18 09:55
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX api_documentsearchvector_vector_gin ON api_documentsearchvector USING gin (vector)'
+        )
+
+
+def drop_search_vector_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX api_documentsearchvector_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_auto_20261018_0952'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSearchVector',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_vector', serialize=False, to='api.Document')),
+                ('vector', django.contrib.postgres.search.SearchVectorField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DocumentTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('frequency', models.IntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='api.Document')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='documentterm',
+            unique_together={('term', 'document')},
+        ),
+        migrations.RunPython(create_search_vector_index, drop_search_vector_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_auto_20261018_0955'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpooledBody',
+            fields=[
+                ('s3_bucket_key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('body', models.BinaryField()),
+                ('content_type', models.CharField(default='text/plain', max_length=100)),
+                ('content_encoding', models.CharField(default='identity', max_length=20)),
+                ('spooled_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='storage_state',
+            field=models.CharField(choices=[('stored', 'Stored'), ('pending', 'Pending')], db_index=True, default='stored', max_length=10),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_auto_20261018_1013'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lenderdocument',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='lenderdocument',
+            index=models.Index(fields=['lender', 'updated_at', 'lender_document_id', 'active_document', 'name'], name='lender_document_listing_idx'),
+        ),
+    ]
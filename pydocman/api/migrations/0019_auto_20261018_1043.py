@@ -0,0 +1,39 @@
+# Generated by Django 2.0.1 on 2026-10-18 10:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_document_lenders(apps, schema_editor):
+    LenderDocument = apps.get_model('api', 'LenderDocument')
+    Document = apps.get_model('api', 'Document')
+    for lender_document_id, lender_id in LenderDocument.objects.values_list('lender_document_id', 'lender_id'):
+        Document.objects.filter(lender_document_id=lender_document_id).update(lender_id=lender_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_auto_20261018_1016'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='document',
+            name='document_published_idx',
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='lender',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.Lender'),
+        ),
+        migrations.RunPython(backfill_document_lenders, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['lender', 'created_at', 'document_id'], name='document_lender_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['lender_document', 'version_minor', 'created_at', 'document_id'], name='document_published_idx'),
+        ),
+    ]
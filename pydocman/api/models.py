@@ -1,21 +1,30 @@
+import hashlib
+import io
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from django.contrib.auth.models import User
+from django.contrib.postgres.search import SearchVectorField
 from django.conf import settings
-from django.db import models
+from django.core.cache import caches
+from django.db import models, transaction
+from django.db.models import F
 from django.db.models.signals import post_save, post_delete
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from django.utils import timezone
 
-from api.documentrepository.localdocumentrepository import LocalDocumentRepository
-from api.documentrepository.s3documentrepository import S3DocumentRepository
+from api.activecontent import invalidate_active_content, set_active_content
+from api.deltastorage import delta_storage_enabled, get_reconstructed_contents
+from api.diff import apply_delta, diff_texts, make_delta
+from api.instrumentation import span
+from api.documentrepository import get_document_repository
+from api.documentrepository.codecs import get_codec
+
+# Sent for every new version, with its content when created from one, or with
+# the version whose stored body it reuses
+document_created = Signal(providing_args=['document', 'content', 'source'])
 
-if settings.ENV == 'local':
-    document_directory = settings.BASE_DIR
-    document_repository = LocalDocumentRepository(document_directory)
-else:
-    document_directory = settings.S3_BUCKET
-    document_repository = S3DocumentRepository(document_directory)
 
 class Lender(models.Model):
     lender_id = models.AutoField(primary_key=True)
@@ -45,90 +54,475 @@ class LenderDocument(models.Model):
     lender = models.ForeignKey(Lender, related_name='document_types', on_delete=models.CASCADE)
     name = models.CharField(max_length=30)
     active_document = models.ForeignKey('Document', default=None, null=True, blank=True, on_delete=models.SET_NULL)
+    latest_version_major = models.IntegerField(default=0)
+    latest_version_minor = models.IntegerField(default=0)
+    # Last change to the name or the active version, drafts do not count
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def etag(self):
+        return '"{}-{}"'.format(self.lender_document_id, self.active_document_id or 0)
+
+    def last_modified(self):
+        if self.active_document_id is None:
+            return None
+        return int(self.active_document.created_at.timestamp())
+
+    def allocate_version(self, publish=False):
+        # The counter row is only ever changed through a single UPDATE, whose row
+        # lock serialises concurrent allocations until the transaction ends
+        with transaction.atomic():
+            lender_documents = LenderDocument.objects.filter(lender_document_id=self.lender_document_id)
+            if publish:
+                lender_documents.update(latest_version_major=F('latest_version_major') + 1, latest_version_minor=0)
+            else:
+                lender_documents.update(latest_version_minor=F('latest_version_minor') + 1)
+            self.latest_version_major, self.latest_version_minor = lender_documents.values_list(
+                'latest_version_major', 'latest_version_minor'
+            ).get()
+        return self.latest_version_major, self.latest_version_minor
+
+    def allocate_versions(self, count):
+        # Reserves count consecutive draft versions with a single UPDATE
+        with transaction.atomic():
+            lender_documents = LenderDocument.objects.filter(lender_document_id=self.lender_document_id)
+            lender_documents.update(latest_version_minor=F('latest_version_minor') + count)
+            self.latest_version_major, self.latest_version_minor = lender_documents.values_list(
+                'latest_version_major', 'latest_version_minor'
+            ).get()
+        first_minor = self.latest_version_minor - count + 1
+        return [(self.latest_version_major, minor) for minor in range(first_minor, self.latest_version_minor + 1)]
 
     class Meta:
+        # Covers listing a lender's document types in update order, with every
+        # listed column, so that listing and its filters can be answered from
+        # the index alone
+        indexes = [
+            models.Index(
+                fields=['lender', 'updated_at', 'lender_document_id', 'active_document', 'name'],
+                name='lender_document_listing_idx'
+            ),
+        ]
         permissions = (
             ("create_lender_document", "Create lender document"),
         )
 
 
 class Document(models.Model):
+    STORED = 'stored'
+    PENDING = 'pending'
+    STORAGE_STATES = (
+        (STORED, 'Stored'),
+        (PENDING, 'Pending'),
+    )
+
     document_id = models.AutoField(primary_key=True)
     s3_bucket = models.CharField(max_length=50)
-    s3_bucket_key = models.CharField(max_length=60)
+    s3_bucket_key = models.CharField(max_length=100)
+    content_digest = models.CharField(max_length=64, null=True, blank=True)
+    content_type = models.CharField(max_length=100, default='text/plain')
+    content_encoding = models.CharField(max_length=20, default='identity')
+    # Set when the stored body is a delta against the body of delta_base. Versions
+    # are never deleted on their own, only along with their whole lender document.
+    delta_base = models.ForeignKey('self', null=True, blank=True, related_name='+', on_delete=models.DO_NOTHING)
+    delta_depth = models.IntegerField(default=0)
+    # Pending while the body waits in the write-behind spool to be uploaded
+    storage_state = models.CharField(max_length=10, choices=STORAGE_STATES, default=STORED, db_index=True)
     created_at = models.DateTimeField(default=timezone.now)
     created_by = models.ForeignKey(User, related_name='drafts', null=True, on_delete=models.SET_NULL)
     version_major = models.IntegerField()
     version_minor = models.IntegerField()
     lender_document = models.ForeignKey(LenderDocument, related_name='documents', on_delete=models.CASCADE)
+    # The lender of lender_document, copied so that a lender's documents can be
+    # listed from one index. Lender documents never move between lenders.
+    lender = models.ForeignKey(Lender, null=True, related_name='+', db_index=False, editable=False,
+                               on_delete=models.CASCADE)
+
+    def save(self, *args, **kwargs):
+        if self.lender_id is None:
+            self.lender_id = self.lender_document.lender_id
+        super().save(*args, **kwargs)
 
     @classmethod
     def create(cls, lender_document, created_user, content):
-        try:
-            prev_document = lender_document.documents.order_by('-created_at')[0]
-            version_major = prev_document.version_major
-            version_minor = prev_document.version_minor + 1
-        except: 
-            version_major = 0
-            version_minor = 1
-
-        s3_bucket_key = '{}/{}-{}_{}_{}'.format(
-            settings.ENV,
-            lender_document.lender.lender_id,
-            lender_document.name.replace(' ', '').lower(),
-            version_major,
-            version_minor
+        version_major, version_minor = lender_document.allocate_version()
+        content_digest = cls.digest(content)
+        content_encoding = get_codec(settings.DOCUMENT_COMPRESSION).name
+        document_repository = get_document_repository()
+        write_behind = settings.DOCUMENT_WRITE_BEHIND
+
+        delta_base = cls.delta_base_for(lender_document) if delta_storage_enabled() else None
+        delta = make_delta(delta_base.get_content(), content) if delta_base else None
+        if delta is not None and len(delta) < len(content):
+            # Only the lines changed since the previous version are uploaded
+            s3_bucket_key = cls.versioned_key(lender_document, version_major, version_minor) + '.delta'
+            body = delta
+        else:
+            delta_base = None
+            body = content
+            if settings.DOCUMENT_CONTENT_ADDRESSED:
+                # Identical bodies share one object, so only the first copy is uploaded
+                s3_bucket_key = cls.content_addressed_key(content_digest, content_encoding)
+                if not write_behind and document_repository.exists(s3_bucket_key):
+                    body = None
+            else:
+                s3_bucket_key = cls.versioned_key(lender_document, version_major, version_minor)
+        if body is not None and not write_behind:
+            document_repository.put(s3_bucket_key, body, content_encoding)
+
+        # The spooled body and its version are committed together
+        with transaction.atomic():
+            if write_behind:
+                SpooledBody.spool(s3_bucket_key, get_codec(content_encoding).compress(body.encode()), content_encoding)
+            document = cls.objects.create(
+                s3_bucket=settings.S3_BUCKET,
+                s3_bucket_key=s3_bucket_key,
+                content_digest=content_digest,
+                content_encoding=content_encoding,
+                delta_base=delta_base,
+                delta_depth=delta_base.delta_depth + 1 if delta_base else 0,
+                storage_state=cls.PENDING if write_behind else cls.STORED,
+                version_major=version_major,
+                version_minor=version_minor,
+                lender_document=lender_document,
+                created_by=created_user
+            )
+        if delta_base is not None:
+            get_reconstructed_contents().set(content_digest, content)
+        document_created.send(sender=cls, document=document, content=content)
+        return document
+
+    @staticmethod
+    def delta_base_for(lender_document):
+        # The latest version, unless the next one is due to be a full snapshot
+        previous = lender_document.documents.order_by('-created_at', '-document_id').first()
+        if previous is None or not previous.has_text_content():
+            return None
+        if previous.delta_depth + 1 >= settings.DOCUMENT_DELTA_SNAPSHOT_INTERVAL:
+            return None
+        return previous
+
+    @classmethod
+    def create_from_stream(cls, lender_document, created_user, stream, content_type):
+        # Copies the body chunk by chunk, so memory use does not depend on its size.
+        # Streamed bodies are stored under their version key as the digest is only
+        # known once the whole body has been read.
+        version_major, version_minor = lender_document.allocate_version()
+        s3_bucket_key = cls.versioned_key(lender_document, version_major, version_minor)
+        # Binary formats are usually compressed already
+        codec = get_codec(settings.DOCUMENT_COMPRESSION if content_type.startswith('text/') else None)
+        sha256 = hashlib.sha256()
+        with get_document_repository().open_write(s3_bucket_key, content_type, codec.name) as f:
+            compressed = codec.open_compress(f)
+            for chunk in iter(lambda: stream.read(settings.DOCUMENT_STREAM_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                compressed.write(chunk)
+            if compressed is not f:
+                compressed.close()
+
+        document = cls.objects.create(
+            s3_bucket=settings.S3_BUCKET,
+            s3_bucket_key=s3_bucket_key,
+            content_digest=sha256.hexdigest(),
+            content_type=content_type,
+            content_encoding=codec.name,
+            version_major=version_major,
+            version_minor=version_minor,
+            lender_document=lender_document,
+            created_by=created_user
         )
-        document_repository.put(s3_bucket_key, content)
+        document_created.send(sender=cls, document=document, content=None)
+        return document
 
-        return cls.objects.create(
+    @classmethod
+    def register_upload(cls, lender_document, created_user, s3_bucket_key, content_type):
+        # Records a body uploaded directly to the repository as a new version. The
+        # body is not read, so it has no digest and is stored exactly as sent.
+        version_major, version_minor = lender_document.allocate_version()
+        document = cls.objects.create(
             s3_bucket=settings.S3_BUCKET,
             s3_bucket_key=s3_bucket_key,
+            content_type=content_type,
             version_major=version_major,
             version_minor=version_minor,
             lender_document=lender_document,
             created_by=created_user
         )
+        document_created.send(sender=cls, document=document, content=None)
+        return document
+
+    @staticmethod
+    def upload_key(lender_document):
+        # Direct uploads are keyed before they are given a version
+        return '{}/uploads/{}/{}'.format(settings.ENV, lender_document.lender_id, uuid.uuid4().hex)
+
+    @staticmethod
+    def versioned_key(lender_document, version_major, version_minor):
+        return '{}/{}-{}_{}_{}'.format(
+            settings.ENV,
+            lender_document.lender_id,
+            lender_document.name.replace(' ', '').lower(),
+            version_major,
+            version_minor
+        )
+
+    @staticmethod
+    def digest(content):
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    def content_addressed_key(content_digest, content_encoding=None):
+        return '{}/sha256/{}{}'.format(settings.ENV, content_digest, get_codec(content_encoding).extension)
+
+    def storage_fields(self):
+        # Fields locating the stored body, shared by versions with the same content
+        return {
+            's3_bucket': self.s3_bucket,
+            's3_bucket_key': self.s3_bucket_key,
+            'content_digest': self.content_digest,
+            'content_type': self.content_type,
+            'content_encoding': self.content_encoding,
+            'delta_base_id': self.delta_base_id,
+            'delta_depth': self.delta_depth,
+            'storage_state': self.storage_state,
+        }
+
+    def etag(self, content_encoding=None):
+        # The version is part of the tag because publishing a first draft renumbers
+        # it in place, and encoded representations get tags of their own
+        content_id = self.content_digest or hashlib.sha256(self.s3_bucket_key.encode()).hexdigest()
+        return '"{}-{}.{}-{}{}"'.format(
+            self.document_id, self.version_major, self.version_minor, content_id[:32],
+            '-' + content_encoding if content_encoding else ''
+        )
+
+    def last_modified(self):
+        return int(self.created_at.timestamp())
+
+    def has_text_content(self):
+        return self.content_type.startswith('text/')
+
+    def is_delta(self):
+        return self.delta_base_id is not None
+
+    def is_pending(self):
+        return self.storage_state == Document.PENDING
+
+    def spooled_body(self):
+        # The stored body while it waits in the write-behind spool, None once it
+        # has been uploaded
+        if not hasattr(self, '_spooled_body'):
+            body = SpooledBody.objects.filter(s3_bucket_key=self.s3_bucket_key).values_list('body', flat=True).first()
+            self._spooled_body = None if body is None else bytes(body)
+        return self._spooled_body
+
+    def prepare_content(self):
+        # Loads from the database everything reading the body needs, so that it
+        # can then be read from another thread without touching the database
+        for document in self.delta_chain():
+            if document.is_pending():
+                document.spooled_body()
+
+    def get_stored_content(self):
+        # The body as stored, a delta for delta-encoded versions
+        if self.is_pending():
+            body = self.spooled_body()
+            if body is not None:
+                return get_codec(self.content_encoding).decompress(body).decode()
+        return get_document_repository().get(self.s3_bucket_key, self.content_encoding)
 
     def get_content(self):
-        return document_repository.get(self.s3_bucket_key)
+        if not self.is_delta():
+            return self.get_stored_content()
+        reconstructed_contents = get_reconstructed_contents()
+        content = reconstructed_contents.get(self.content_digest)
+        if content is None:
+            content = self.reconstruct_content()
+            reconstructed_contents.set(self.content_digest, content)
+        return content
+
+    def reconstruct_content(self):
+        # Applies the deltas stored since the nearest snapshot or cached body
+        reconstructed_contents = get_reconstructed_contents()
+        deltas = []
+        for document in self.delta_chain():
+            if not document.is_delta():
+                content = document.get_stored_content()
+                break
+            if document is not self:
+                content = reconstructed_contents.get(document.content_digest)
+                if content is not None:
+                    break
+            deltas.append(document)
+        for document in reversed(deltas):
+            content = apply_delta(content, document.get_stored_content())
+        return content
+
+    def delta_chain(self):
+        # This version followed by the versions its body is rebuilt from, back to
+        # the nearest snapshot. Loaded once, so other threads can rebuild the body
+        # without touching the database.
+        if not hasattr(self, '_delta_chain'):
+            chain = [self]
+            while chain[-1].is_delta():
+                chain.append(chain[-1].delta_base)
+            self._delta_chain = chain
+        return self._delta_chain
+
+    def open_content(self):
+        if self.is_delta():
+            return io.BytesIO(self.get_content().encode())
+        return get_codec(self.content_encoding).open_decompress(self.open_stored_content())
+
+    def open_stored_content(self):
+        # The body as stored, still encoded with content_encoding
+        if self.is_pending():
+            body = self.spooled_body()
+            if body is not None:
+                return io.BytesIO(body)
+        return get_document_repository().open_read(self.s3_bucket_key)
+
+    @staticmethod
+    def get_contents(documents):
+        # Fetches the contents of several documents concurrently, returning the
+        # contents and the errors raised while fetching them by document id
+        contents, errors = {}, {}
+        if not documents:
+            return contents, errors
+        for document in documents:
+            document.prepare_content()
+        max_workers = min(settings.DOCUMENT_FETCH_MAX_WORKERS, len(documents))
+        # Worker threads record no spans of their own, the wait is timed here instead
+        with span('storage'), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(document, executor.submit(document.get_content)) for document in documents]
+            for document, future in futures:
+                try:
+                    contents[document.document_id] = future.result()
+                except Exception as e:
+                    errors[document.document_id] = e
+        return contents, errors
+
+    def diff(self, against, granularity='line'):
+        # Versions are immutable, so the diff of a pair never has to be invalidated
+        key = 'document-diff:{}:{}:{}'.format(against.document_id, self.document_id, granularity)
+        diff_cache = caches[settings.DOCUMENT_DIFF_CACHE]
+        diff = diff_cache.get(key)
+        if diff is None:
+            contents, errors = Document.get_contents([against, self])
+            for error in errors.values():
+                raise error
+            diff = diff_texts(contents[against.document_id], contents[self.document_id], granularity)
+            diff_cache.set(key, diff, settings.DOCUMENT_DIFF_CACHE_TIMEOUT)
+        return diff
     
     def revert(self, created_user):
-        if self.lender_document.active_document == self:
+        if self.lender_document.active_document_id == self.document_id:
             return # Do nothing if active document is being reverted
-        return Document.create(self.lender_document, created_user, self.get_content())
+        # Versions are immutable, so the reverted version points at the same stored body
+        version_major, version_minor = self.lender_document.allocate_version()
+        document = Document.objects.create(
+            version_major=version_major,
+            version_minor=version_minor,
+            lender_document=self.lender_document,
+            created_by=created_user,
+            **self.storage_fields()
+        )
+        document_created.send(sender=Document, document=document, source=self)
+        return document
 
     def publish(self):
-        if not self.lender_document.active_document:
-            self.version_major = 1
-            self.version_minor = 0
-            self.created_at = timezone.now()
-            self.save()
-            lender_document = self.lender_document
-            lender_document.active_document = self
-            lender_document.version_number = 1
-            lender_document.save()
-            return self
-        if self.lender_document.active_document == self:
+        lender_document = self.lender_document
+        if lender_document.active_document_id == self.document_id:
             return self # Do nothing if active document being republished
 
-        new_version_major = self.lender_document.active_document.version_major + 1
-        document = Document.objects.create(
-            s3_bucket=settings.S3_BUCKET,
-            s3_bucket_key=self.s3_bucket_key,
-            version_major=new_version_major,
-            version_minor=0,
-            lender_document=self.lender_document,
-            created_by=self.created_by # Change to publish?
-        )
-        self.lender_document.active_document = document
-        self.lender_document.version_number = new_version_major
-        self.lender_document.save()
+        with transaction.atomic():
+            version_major, version_minor = lender_document.allocate_version(publish=True)
+            lender_document.refresh_from_db(fields=['active_document'])
+            if lender_document.active_document_id is None:
+                self.version_major = version_major
+                self.version_minor = version_minor
+                self.created_at = timezone.now()
+                self.save()
+                document = self
+            else:
+                document = Document.objects.create(
+                    version_major=version_major,
+                    version_minor=version_minor,
+                    lender_document=lender_document,
+                    created_by=self.created_by, # Change to publish?
+                    **self.storage_fields()
+                )
+                document_created.send(sender=Document, document=document, source=self)
+            lender_document.active_document = document
+            lender_document.save(update_fields=['active_document', 'updated_at'])
+        document.cache_active_content()
         return document
 
+    def cache_active_content(self):
+        content = self.get_content() if self.has_text_content() else None
+        set_active_content(self.lender_document_id, self, content)
+        return content
+
     class Meta:
+        unique_together = (('lender_document', 'version_major', 'version_minor'),)
+        indexes = [
+            models.Index(fields=['created_at', 'document_id'], name='document_created_idx'),
+            models.Index(fields=['lender', 'created_at', 'document_id'], name='document_lender_created_idx'),
+            models.Index(fields=['lender_document', 'created_at', 'document_id'], name='document_type_created_idx'),
+            models.Index(
+                fields=['lender_document', 'version_minor', 'created_at', 'document_id'],
+                name='document_published_idx'
+            ),
+        ]
         permissions = (
             ("read_document", "Read documents"),
             ("draft_document", "Draft documents"),
             ("publish_document", "Publish documents"),
         )
+
+
+class SpooledBody(models.Model):
+    # Bodies of versions created in write-behind mode, encoded as stored, until
+    # `manage.py drain_spool` uploads them to the document repository
+    s3_bucket_key = models.CharField(max_length=100, primary_key=True)
+    body = models.BinaryField()
+    content_type = models.CharField(max_length=100, default='text/plain')
+    content_encoding = models.CharField(max_length=20, default='identity')
+    spooled_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    @classmethod
+    def spool(cls, s3_bucket_key, body, content_encoding, content_type='text/plain'):
+        # Versions sharing a content-addressed key share its spooled body
+        cls.objects.update_or_create(s3_bucket_key=s3_bucket_key, defaults={
+            'body': body,
+            'content_type': content_type,
+            'content_encoding': content_encoding,
+        })
+
+
+class DocumentTerm(models.Model):
+    # Portable inverted index of document contents, used for search on
+    # databases without full-text support
+    document = models.ForeignKey(Document, related_name='terms', on_delete=models.CASCADE)
+    term = models.CharField(max_length=64)
+    frequency = models.IntegerField()
+
+    class Meta:
+        unique_together = (('term', 'document'),)
+
+
+class DocumentSearchVector(models.Model):
+    # Full-text index of document contents, only maintained on PostgreSQL
+    document = models.OneToOneField(Document, primary_key=True, related_name='search_vector', on_delete=models.CASCADE)
+    vector = SearchVectorField()
+
+
+@receiver(post_save, sender=LenderDocument)
+def invalidate_lender_document_active_content(sender, instance, **kwargs):
+    invalidate_active_content(instance.lender_document_id, unless_document_id=instance.active_document_id)
+
+
+@receiver(post_delete, sender=Document)
+def invalidate_document_active_content(sender, instance, **kwargs):
+    invalidate_active_content(instance.lender_document_id)
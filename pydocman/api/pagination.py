@@ -0,0 +1,88 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    # Seeks past the last row of the previous page using the (ordering field,
+    # primary key) pair instead of OFFSET, and never counts the queryset, so
+    # the cost of a page does not grow with the depth of the page.
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('created_at', 'document_id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request, queryset.model)
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            field, tiebreaker = self.ordering
+            value, tiebreaker_value = position
+            queryset = queryset.filter(
+                Q(**{field + '__gt': value}) |
+                Q(**{field: value, tiebreaker + '__gt': tiebreaker_value})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return api_settings.PAGE_SIZE
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        # Pages hold model instances or .values() rows
+        position = [last[name] if isinstance(last, dict) else getattr(last, name) for name in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position))
+
+    def encode_cursor(self, position):
+        value, tiebreaker_value = position
+        payload = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, tiebreaker_value])
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if len(position) != len(self.ordering):
+                raise ValueError(position)
+            return tuple(
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.ordering, position)
+            )
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+
+class LenderDocumentKeysetPagination(KeysetPagination):
+    ordering = ('updated_at', 'lender_document_id')
@@ -1,24 +1,44 @@
-from rest_framework import permissions
+from rest_framework import exceptions, permissions
+
+from .principal import get_principal
 
 
 class DocumentModelPublishPermission(permissions.BasePermission):
     message = 'User does not have permission to publish documents.'
 
     def has_permission(self, request, view):
-        return request.user.has_perm('api.publish_document')
+        return get_principal(request.user).has_perm('api.publish_document')
 
 class DocumentModelRevertPermission(permissions.BasePermission):
     message = 'User does not have permission to revert documents.'
 
     def has_permission(self, request, view):
-        return request.user.has_perm('api.draft_document')
-
-class DocumentModelPermission(permissions.DjangoModelPermissions):
-    def __init__(self):
-        self.perms_map['GET'] = ['api.read_document']
-        self.perms_map['POST'] = ['api.draft_document']
+        return get_principal(request.user).has_perm('api.draft_document')
 
 
-class LenderDocumentModelPermission(permissions.DjangoModelPermissions):
-    def __init__(self):
-        self.perms_map['POST'] = ['api.create_lender_document']
\ No newline at end of file
+class PrincipalModelPermissions(permissions.DjangoModelPermissions):
+    # perms_map holds full permission names, checked against the cached principal
+    def has_permission(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return False
+        if request.method not in self.perms_map:
+            raise exceptions.MethodNotAllowed(request.method)
+        return get_principal(request.user).has_perms(self.perms_map[request.method])
+
+
+class DocumentModelPermission(PrincipalModelPermissions):
+    perms_map = dict(
+        permissions.DjangoModelPermissions.perms_map,
+        GET=['api.read_document'],
+        POST=['api.draft_document']
+    )
+
+
+class LenderDocumentModelPermission(PrincipalModelPermissions):
+    # Reading document types needs read_document, as it did when both classes
+    # shared one perms_map
+    perms_map = dict(
+        permissions.DjangoModelPermissions.perms_map,
+        GET=['api.read_document'],
+        POST=['api.create_lender_document']
+    )
@@ -0,0 +1,110 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+# What authorization needs to know about a user, resolved once and cached by
+# username for PRINCIPAL_CACHE_TIMEOUT seconds when PRINCIPAL_CACHE is set. Any
+# change to users, profiles, groups or permissions bumps a generation number that
+# is part of every key, which drops all cached principals at once.
+
+GENERATION_KEY = 'principal-generation'
+
+
+class Principal(namedtuple('Principal', ('user_id', 'lender_id', 'is_superuser', 'permissions'))):
+    def has_perm(self, perm):
+        return self.is_superuser or perm in self.permissions
+
+    def has_perms(self, perms):
+        return all(self.has_perm(perm) for perm in perms)
+
+
+def _cache():
+    if settings.PRINCIPAL_CACHE is None:
+        return None
+    return caches[settings.PRINCIPAL_CACHE]
+
+
+@register()
+def check_principal_cache(app_configs, **kwargs):
+    # Other processes would keep serving principals invalidated in this one
+    if settings.PRINCIPAL_CACHE is not None and isinstance(_cache(), LocMemCache):
+        return [Error(
+            'PRINCIPAL_CACHE must be shared by all processes, {!r} is a local-memory cache.'.format(
+                settings.PRINCIPAL_CACHE
+            ),
+            hint='Configure a shared cache such as memcached, or set PRINCIPAL_CACHE to None.',
+            id='api.E001',
+        )]
+    return []
+
+
+def _key(username):
+    return 'principal:{}:{}'.format(_cache().get(GENERATION_KEY, 0), username)
+
+
+def resolve_principal(user):
+    from api.models import Profile
+    lender_id = Profile.objects.filter(user_id=user.pk).values_list('lender_id', flat=True).first()
+    return Principal(user.pk, lender_id, user.is_superuser, frozenset(user.get_all_permissions()))
+
+
+def get_principal(user):
+    principal = getattr(user, '_principal', None)
+    if principal is None:
+        entry = get_cached_user(user.get_username())
+        if entry is not None and entry[0].pk == user.pk:
+            principal = entry[1]
+        else:
+            principal = resolve_principal(user)
+            cache_user(user, principal)
+        user._principal = principal
+    return principal
+
+
+def get_cached_user(username):
+    if _cache() is None:
+        return None
+    return _cache().get(_key(username))
+
+
+def cache_user(user, principal):
+    if _cache() is None:
+        return
+    user = User(**{field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields})
+    _cache().set(_key(user.get_username()), (user, principal), settings.PRINCIPAL_CACHE_TIMEOUT)
+
+
+def invalidate_principals():
+    cache = _cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(post_save, sender='api.Profile')
+@receiver(post_delete, sender='api.Profile')
+def invalidate_principals_on_change(sender, **kwargs):
+    invalidate_principals()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_principals_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_principals()
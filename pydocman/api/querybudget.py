@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.queries = []
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries(using=None):
+    counter = QueryCounter()
+    with (using or connection).execute_wrapper(counter):
+        yield counter
+
+
+@contextmanager
+def query_budget(max_queries, using=None):
+    # Raises QueryBudgetExceeded when the wrapped block runs more than
+    # max_queries queries, e.g. `with query_budget(3): client.get(url)`
+    with count_queries(using) as counter:
+        yield counter
+    if counter.count > max_queries:
+        raise QueryBudgetExceeded(
+            '{} queries executed, budget is {}:\n{}'.format(counter.count, max_queries, '\n'.join(counter.queries))
+        )
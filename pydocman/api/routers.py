@@ -0,0 +1,157 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+from .principal import get_principal
+
+# Sends the reads of safe requests to the document and lender document endpoints
+# to DATABASE_REPLICAS in turn, and everything else to the primary. Replicas are
+# health checked at most every DATABASE_REPLICA_HEALTH_CHECK_INTERVAL seconds and
+# skipped while failing. A client whose request may have written reads from the
+# primary for DATABASE_REPLICA_STICKY_SECONDS afterwards, so they see their own
+# writes however far the replicas lag behind, as does the rest of a request once
+# it has written. The pin is a signed cookie, so it holds in every container.
+
+_state = threading.local()
+
+
+@contextmanager
+def replica_reads():
+    previous = getattr(_state, 'replica_reads', False)
+    _state.replica_reads = True
+    try:
+        yield
+    finally:
+        _state.replica_reads = previous
+
+
+STICKY_SALT = 'api.routers.primary'
+
+
+def stick_to_primary(request, response):
+    if settings.DATABASE_REPLICAS and request.user.is_authenticated:
+        response.set_signed_cookie(
+            settings.DATABASE_REPLICA_STICKY_COOKIE, str(request.user.pk), salt=STICKY_SALT,
+            max_age=settings.DATABASE_REPLICA_STICKY_SECONDS, httponly=True
+        )
+
+
+def is_stuck_to_primary(request):
+    # Signed with the time it was set, and only valid for the user it was set for
+    user_id = request.get_signed_cookie(
+        settings.DATABASE_REPLICA_STICKY_COOKIE, default=None, salt=STICKY_SALT,
+        max_age=settings.DATABASE_REPLICA_STICKY_SECONDS
+    )
+    return request.user.is_authenticated and user_id == str(request.user.pk)
+
+
+class ReplicaHealth:
+    def __init__(self):
+        self.checked_at = {}
+        self.healthy = {}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            due = now - self.checked_at.get(alias, float('-inf')) >= settings.DATABASE_REPLICA_HEALTH_CHECK_INTERVAL
+            if due:
+                # Other threads keep the previous result until this check is done
+                self.checked_at[alias] = now
+        if due:
+            self.healthy[alias] = self.check(alias)
+        return self.healthy.get(alias, False)
+
+    def check(self, alias):
+        connection = None
+        try:
+            connection = connections[alias]
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                max_lag = settings.DATABASE_REPLICA_MAX_LAG
+                if max_lag is not None and connection.vendor == 'postgresql':
+                    # Seconds since the last replayed transaction, or 0 once
+                    # everything received has been replayed
+                    cursor.execute(
+                        'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                        'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+                    )
+                    lag = cursor.fetchone()[0]
+                    return lag is None or lag <= max_lag
+            return True
+        except Exception:
+            if connection is not None:
+                connection.close()
+            return False
+
+    def reset(self):
+        with self.lock:
+            self.checked_at.clear()
+            self.healthy.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.next_replica = 0
+        self.lock = threading.Lock()
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'replica_reads', False) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = settings.DATABASE_REPLICAS
+        with self.lock:
+            start = self.next_replica
+            self.next_replica = (start + 1) % len(replicas) if replicas else 0
+        for i in range(len(replicas)):
+            alias = replicas[(start + i) % len(replicas)]
+            if replica_health.is_healthy(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # The rest of the request reads what it has written
+        _state.replica_reads = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the primary's schema through replication
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaReadMixin:
+    # For viewsets whose safe requests may read from replicas
+    def initial(self, request, *args, **kwargs):
+        # Authentication and permission checks always read from the primary
+        super().initial(request, *args, **kwargs)
+        if settings.DATABASE_REPLICAS and request.method in SAFE_METHODS and not is_stuck_to_primary(request):
+            if request.user.is_authenticated:
+                # As does resolving the principal, which querysets scope on
+                get_principal(request.user)
+            _state.replica_reads = True
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS:
+            stick_to_primary(request, response)
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _state.replica_reads = False
@@ -0,0 +1,107 @@
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Sum, Value, When
+from django.dispatch import receiver
+
+from api.models import DocumentSearchVector, DocumentTerm, document_created
+
+logger = logging.getLogger(__name__)
+
+# Search over document contents. PostgreSQL databases use its full-text search
+# on a tsvector per document, others an inverted index of lower-cased words
+# ranked by term frequency weighted by rarity.
+
+TERM_RE = re.compile(r'\w+')
+MAX_TERM_LENGTH = 64
+MAX_QUERY_TERMS = 16
+
+
+def tokenize(content):
+    return [term for term in TERM_RE.findall(content.lower()) if len(term) <= MAX_TERM_LENGTH]
+
+
+def uses_full_text_search():
+    backend = settings.DOCUMENT_SEARCH_BACKEND or ('postgres' if connection.vendor == 'postgresql' else 'table')
+    return backend == 'postgres'
+
+
+def index_document(document, content):
+    if uses_full_text_search():
+        vector = SearchVector(Value(content), config=settings.DOCUMENT_SEARCH_CONFIG)
+        DocumentSearchVector.objects.update_or_create(document=document, defaults={'vector': vector})
+        return
+    with transaction.atomic():
+        DocumentTerm.objects.filter(document=document).delete()
+        DocumentTerm.objects.bulk_create([
+            DocumentTerm(document=document, term=term, frequency=frequency)
+            for term, frequency in Counter(tokenize(content)).items()
+        ])
+
+
+def copy_document_index(source, document):
+    # Versions reusing a stored body reuse its index entries as well
+    if uses_full_text_search():
+        for vector in DocumentSearchVector.objects.filter(document=source).values_list('vector', flat=True):
+            DocumentSearchVector.objects.create(document=document, vector=vector)
+        return
+    DocumentTerm.objects.bulk_create([
+        DocumentTerm(document=document, term=term, frequency=frequency)
+        for term, frequency in DocumentTerm.objects.filter(document=source).values_list('term', 'frequency')
+    ])
+
+
+def search_documents(documents, query, limit):
+    # The documents containing every term of the query, best ranked first.
+    # Each result has its score in a rank attribute.
+    if uses_full_text_search():
+        search_query = SearchQuery(query, config=settings.DOCUMENT_SEARCH_CONFIG)
+        return list(
+            documents.filter(search_vector__vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector__vector'), search_query))
+            .order_by('-rank', '-document_id')[:limit]
+        )
+
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return []
+    document_frequencies = dict(
+        DocumentTerm.objects.filter(term__in=terms).values_list('term').annotate(Count('document_id'))
+    )
+    if len(document_frequencies) < len(terms):
+        return []
+    weights = [
+        When(terms__term=term, then=ExpressionWrapper(
+            F('terms__frequency') * Value(1.0 / document_frequencies[term]), output_field=FloatField()
+        ))
+        for term in terms
+    ]
+    return list(
+        documents.filter(terms__term__in=terms)
+        .annotate(matched_terms=Count('terms'), rank=Sum(Case(*weights, output_field=FloatField())))
+        .filter(matched_terms=len(terms))
+        .order_by('-rank', '-document_id')[:limit]
+    )
+
+
+@receiver(document_created)
+def index_created_document(sender, document, content=None, source=None, **kwargs):
+    # Streamed and direct uploads were never held in memory, reading them back
+    # here would download the whole body. They are left to index_documents.
+    if not settings.DOCUMENT_SEARCH_INDEX or not document.has_text_content():
+        return
+    if source is None and content is None:
+        return
+    try:
+        # A failed index must not fail the create, nor its transaction
+        with transaction.atomic():
+            if source is not None:
+                copy_document_index(source, document)
+            else:
+                index_document(document, content)
+    except Exception:
+        logger.exception('Could not index document %s', document.document_id)
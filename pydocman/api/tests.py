@@ -1,13 +1,58 @@
 import json
+import gzip
+import io
+import os
+import tarfile
+import tempfile
+import threading
 import time
+import zipfile
 
+from django.conf import settings
 from django.contrib.auth.models import User, Permission
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from .models import Document, LenderDocument, Lender
+from .benchmark import run_benchmark
+from .deltastorage import get_reconstructed_contents, reset_reconstructed_contents
+from .diff import apply_delta, diff_opcodes, diff_texts, make_delta
+from .export import export_documents
+from .documentrepository import get_document_repository, reset_document_repository
+from .documentrepository.cacheddocumentrepository import CachedDocumentRepository
+from .documentrepository.localdocumentrepository import LocalDocumentRepository
+from .instrumentation import metrics
+from .models import Document, LenderDocument, Lender, SpooledBody
+from .principal import check_principal_cache
+from .querybudget import QueryBudgetExceeded, query_budget
+from .routers import ReplicaRouter, replica_health, replica_reads
+from .serializers import (
+    DOCUMENT_VALUES, LENDER_DOCUMENT_VALUES, DocumentSerializer, LenderDocumentSerializer,
+    serialize_document_values, serialize_lender_document_values
+)
+from .transfer import UPLOAD_SALT, load_token
+from .writebehind import drain_spool
+
+
+class InMemoryDocumentRepository:
+    def __init__(self):
+        self.contents = {}
+        self.gets = 0
+
+    def get(self, key, content_encoding=None):
+        self.gets += 1
+        return self.contents[key]
+
+    def put(self, key, content, content_encoding=None):
+        self.contents[key] = content
+
+    def exists(self, key):
+        return key in self.contents
 
 
 class DocumentTests(APITestCase):
@@ -19,6 +64,7 @@ class DocumentTests(APITestCase):
         return user
 
     def setUp(self):
+        cache.clear()
         p_r = Permission.objects.get(codename='read_document')
         p_w = Permission.objects.get(codename='draft_document')
         p_x = Permission.objects.get(codename='publish_document')
@@ -87,16 +133,959 @@ class DocumentTests(APITestCase):
         self.client.force_authenticate(user=self.users['u_rwx'])
         response = self.client.post(url)
 
-        # Sleep 3 seconds for S3 to replicate
-        # From AWS S3 Developer Docs:
-        #     However, information about the changes might not immediately replicate across 
-        #     Amazon S3 and you might observe the following behaviors: A process writes a
-        #     new object to Amazon S3 and immediately attempts to read it. Until the change
-        #     is fully propagated, Amazon S3 might report "key does not exist."
-        time.sleep(3)
-
         lender_document = LenderDocument.objects.get(lender_document_id=self.lender_document.lender_document_id)
         documents = lender_document.documents.order_by('-created_at')
         self.assertEquals(previous_active_document.version_major + 1, lender_document.active_document.version_major)
         self.assertEquals(0, lender_document.active_document.version_minor)
         self.assertEquals(published_document.s3_bucket_key, lender_document.active_document.s3_bucket_key)
+
+    def test_batch_retrieve_documents(self):
+        first = self.lender_document.documents.all()[0]
+        second = Document.create(
+            lender_document=self.lender_document,
+            created_user=self.users['u_rwx'],
+            content='SECOND'
+        )
+        other_lender_document = LenderDocument.objects.create(lender=Lender.objects.create(name='other'), name='other')
+        other = Document.create(lender_document=other_lender_document, created_user=None, content='OTHER')
+        url = reverse('document-batch')
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(url, {
+            'ids': '{},{},{},x'.format(second.document_id, first.document_id, other.document_id),
+            'include_content': '1'
+        })
+        self.assertEquals(response.status_code, 200)
+        batch = json.loads(response.content.decode('utf-8'))
+        self.assertEquals([d['document_id'] for d in batch['results']], [second.document_id, first.document_id])
+        self.assertEquals([d['content'] for d in batch['results']], ['SECOND', 'TESTDOCUMENTCONTENT'])
+        self.assertEquals(sorted(str(e['document_id']) for e in batch['errors']), sorted([str(other.document_id), 'x']))
+
+    def test_list_document_cursor_pagination(self):
+        for i in range(4):
+            Document.create(
+                lender_document=self.lender_document,
+                created_user=self.users['u_rwx'],
+                content='DRAFT {}'.format(i)
+            )
+        expected = list(self.lender_document.documents.order_by('created_at', 'document_id').values_list('document_id', flat=True))
+        self.client.force_authenticate(user=self.users['u_r'])
+        url = reverse('document-list') + '?pagination=cursor&limit=2'
+        seen = []
+        while url:
+            page = json.loads(self.client.get(url).content.decode('utf-8'))
+            self.assertNotIn('count', page)
+            seen.extend(d['document_id'] for d in page['results'])
+            url = page['next']
+        self.assertEquals(seen, expected)
+
+    def test_list_document_invalid_cursor(self):
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(reverse('document-list'), {'cursor': 'garbage'})
+        self.assertEquals(response.status_code, 404)
+
+    def test_revert_document_reuses_stored_body(self):
+        document = self.lender_document.documents.all()[0]
+        Document.create(self.lender_document, self.users['u_rwx'], 'NEWER').publish()
+        reverted = document.revert(self.users['u_rwx'])
+        self.assertEquals((reverted.version_major, reverted.version_minor), (1, 1))
+        self.assertEquals(reverted.s3_bucket_key, document.s3_bucket_key)
+        self.assertEquals(reverted.content_digest, document.content_digest)
+        self.assertEquals(reverted.get_content(), 'TESTDOCUMENTCONTENT')
+
+    @override_settings(DOCUMENT_CONTENT_ADDRESSED=True)
+    def test_content_addressed_documents_share_body(self):
+        first = Document.create(self.lender_document, self.users['u_rwx'], 'BOILERPLATE')
+        second = Document.create(self.lender_document, self.users['u_rwx'], 'BOILERPLATE')
+        self.assertEquals(first.s3_bucket_key, second.s3_bucket_key)
+        self.assertEquals(first.s3_bucket_key, Document.content_addressed_key(Document.digest('BOILERPLATE')))
+        self.assertEquals(second.get_content(), 'BOILERPLATE')
+
+    @override_settings(DOCUMENT_CONTENT_ADDRESSED=True)
+    def test_migrate_content_addressed(self):
+        legacy = self.lender_document.documents.all()[0]
+        call_command('migrate_content_addressed', stdout=open(os.devnull, 'w'))
+        legacy.refresh_from_db()
+        self.assertEquals(legacy.s3_bucket_key, Document.content_addressed_key(Document.digest('TESTDOCUMENTCONTENT')))
+        self.assertEquals(legacy.get_content(), 'TESTDOCUMENTCONTENT')
+
+    def test_upload_and_download_binary_document(self):
+        body = bytes(range(256)) * 1000
+        url = reverse('document-upload') + '?lender_document_id={}'.format(self.lender_document.lender_document_id)
+        self.client.force_authenticate(user=self.users['u_rw'])
+        response = self.client.generic('POST', url, body, content_type='application/pdf')
+        self.assertEquals(response.status_code, 201)
+        document = json.loads(response.content.decode('utf-8'))
+        self.assertEquals(document['content_type'], 'application/pdf')
+
+        response = self.client.get(reverse('document-detail', kwargs={'pk': document['document_id']}))
+        self.assertIsNone(json.loads(response.content.decode('utf-8'))['content'])
+        response = self.client.get(reverse('document-content', kwargs={'pk': document['document_id']}))
+        self.assertEquals(response['Content-Type'], 'application/pdf')
+        self.assertEquals(b''.join(response.streaming_content), body)
+
+    def test_upload_to_other_lender_not_found(self):
+        other_lender = Lender.objects.create(name='other_lender_name')
+        other_lender_document = LenderDocument.objects.create(lender=other_lender, name='other_lender_document')
+        url = reverse('document-upload') + '?lender_document_id={}'.format(other_lender_document.lender_document_id)
+        self.client.force_authenticate(user=self.users['u_rw'])
+        response = self.client.generic('POST', url, b'BODY', content_type='text/plain')
+        self.assertEquals(response.status_code, 404)
+        self.assertEquals(other_lender_document.documents.count(), 0)
+
+    def test_retrieve_document_not_modified(self):
+        document = self.lender_document.documents.all()[0]
+        url = reverse('document-detail', kwargs={'pk': document.document_id})
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEquals(response.status_code, 200)
+
+    def test_retrieve_lender_document_not_modified_until_publish(self):
+        url = reverse('lenderdocument-detail', kwargs={'pk': self.lender_document.lender_document_id})
+        self.client.force_authenticate(user=self.users['u_r'])
+        etag = self.client.get(url)['ETag']
+        self.assertEquals(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.lender_document.documents.all()[0].publish()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content.decode('utf-8'))['active_version'], 1)
+
+    def test_active_requires_read_permission(self):
+        self.lender_document.documents.all()[0].publish()
+        url = reverse('lenderdocument-active', kwargs={'pk': self.lender_document.lender_document_id})
+        self.client.force_authenticate(user=self.users['u_none'])
+        self.assertEquals(self.client.get(url).status_code, 403)
+
+    def test_lender_document_read_permission(self):
+        list_url = reverse('lenderdocument-list')
+        detail_url = reverse('lenderdocument-detail', kwargs={'pk': self.lender_document.lender_document_id})
+        self.client.force_authenticate(user=self.users['u_none'])
+        self.assertEquals(self.client.get(list_url).status_code, 403)
+        self.assertEquals(self.client.get(detail_url).status_code, 403)
+        self.client.force_authenticate(user=self.users['u_r'])
+        self.assertEquals(self.client.get(list_url).status_code, 200)
+        self.assertEquals(self.client.get(detail_url).status_code, 200)
+
+    def test_active_content_served_from_cache(self):
+        url = reverse('lenderdocument-active', kwargs={'pk': self.lender_document.lender_document_id})
+        self.client.force_authenticate(user=self.users['u_r'])
+        self.assertEquals(self.client.get(url).status_code, 404)
+
+        document = self.lender_document.documents.all()[0].publish()
+        repository_reads = get_document_repository().stats()
+        response = self.client.get(url)
+        active = json.loads(response.content.decode('utf-8'))
+        self.assertEquals(active['document_id'], document.document_id)
+        self.assertEquals(active['content'], 'TESTDOCUMENTCONTENT')
+        self.assertEquals(get_document_repository().stats()['hits'], repository_reads['hits'])
+        self.assertEquals(get_document_repository().stats()['misses'], repository_reads['misses'])
+
+        Document.create(self.lender_document, self.users['u_rwx'], 'REPUBLISHED').publish()
+        active = json.loads(self.client.get(url).content.decode('utf-8'))
+        self.assertEquals(active['content'], 'REPUBLISHED')
+
+    @override_settings(DOCUMENT_COMPRESSION='gzip')
+    def test_compressed_document_passthrough(self):
+        content = 'The borrower agrees to the terms. ' * 200
+        document = Document.create(self.lender_document, self.users['u_rwx'], content)
+        self.assertEquals(document.content_encoding, 'gzip')
+        with document.open_stored_content() as f:
+            stored = f.read()
+        self.assertLess(len(stored), len(content) // 5)
+        self.assertEquals(document.get_content(), content)
+
+        url = reverse('document-content', kwargs={'pk': document.document_id})
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(gzip.decompress(b''.join(response.streaming_content)).decode(), content)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEquals(b''.join(response.streaming_content).decode(), content)
+        response = self.client.get(reverse('document-detail', kwargs={'pk': document.document_id}))
+        self.assertEquals(json.loads(response.content.decode('utf-8'))['content'], content)
+
+        self.client.force_authenticate(user=self.users['u_rw'])
+        url = reverse('document-upload') + '?lender_document_id={}'.format(self.lender_document.lender_document_id)
+        response = self.client.generic('POST', url, content.encode(), content_type='text/plain')
+        uploaded = Document.objects.get(document_id=json.loads(response.content.decode('utf-8'))['document_id'])
+        self.assertEquals(uploaded.content_encoding, 'gzip')
+        self.assertEquals(uploaded.get_content(), content)
+
+    def test_diff_against_active(self):
+        self.lender_document.documents.all()[0].publish()
+        draft = Document.create(self.lender_document, self.users['u_rwx'], 'TESTDOCUMENTCONTENT\nADDED\n')
+        self.client.force_authenticate(user=self.users['u_r'])
+        url = reverse('document-diff', kwargs={'pk': draft.document_id})
+        diff = json.loads(self.client.get(url, {'against': 'active'}).content.decode('utf-8'))
+        self.assertEquals(diff['against_document_id'], self.lender_document.documents.get(version_minor=0).document_id)
+        self.assertEquals((diff['inserted'], diff['deleted']), (2, 1))
+        self.assertEquals(diff['changes'], [
+            {'op': 'replace', 'base_start': 0, 'start': 0, 'removed': 'TESTDOCUMENTCONTENT', 'added': 'TESTDOCUMENTCONTENT\nADDED\n'}
+        ])
+
+    def test_diff_is_cached(self):
+        first = self.lender_document.documents.all()[0]
+        second = Document.create(self.lender_document, self.users['u_rwx'], 'TESTDOCUMENT CONTENT')
+        self.client.force_authenticate(user=self.users['u_r'])
+        url = reverse('document-diff', kwargs={'pk': second.document_id})
+        response = self.client.get(url, {'against': first.document_id, 'granularity': 'word'})
+        get_document_repository().clear()
+        with self.assertNumQueries(2):
+            cached = self.client.get(url, {'against': first.document_id, 'granularity': 'word'})
+        self.assertEquals(response.content, cached.content)
+        self.assertEquals(json.loads(cached.content.decode('utf-8'))['changes'], [
+            {'op': 'replace', 'base_start': 0, 'start': 0, 'removed': 'TESTDOCUMENTCONTENT', 'added': 'TESTDOCUMENT CONTENT'}
+        ])
+
+    def test_large_word_diff_bounded(self):
+        lines = ['clause {} of the agreement\n'.format(i) for i in range(5000)]
+        base = ''.join(lines)
+        content = ''.join('amended ' + line if i % 3 == 0 else line for i, line in enumerate(lines))
+        started = time.perf_counter()
+        diff = diff_texts(base, content, 'word')
+        self.assertLess(time.perf_counter() - started, 5)
+        self.assertEquals((diff['inserted'], diff['deleted']), (3334, 0))
+
+    def test_diff_scoped_to_lender(self):
+        other_lender = Lender.objects.create(name='other_lender')
+        other_lender_document = LenderDocument.objects.create(lender=other_lender, name='other')
+        other = Document.create(other_lender_document, self.users['u_rwx'], 'OTHER')
+        document = self.lender_document.documents.all()[0]
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(reverse('document-diff', kwargs={'pk': document.document_id}), {'against': other.document_id})
+        self.assertEquals(response.status_code, 400)
+        response = self.client.get(reverse('document-diff', kwargs={'pk': document.document_id}))
+        self.assertEquals(response.status_code, 404)
+
+    def search(self, user, **params):
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('document-search'), params)
+        return [d['document_id'] for d in json.loads(response.content.decode('utf-8'))['results']]
+
+    def test_search_ranks_matches(self):
+        once = Document.create(self.lender_document, self.users['u_rwx'], 'The borrower repays the loan.')
+        twice = Document.create(self.lender_document, self.users['u_rwx'], 'Loan terms. The loan is repaid by the borrower.')
+        Document.create(self.lender_document, self.users['u_rwx'], 'The lender owns the loan.')
+        self.assertEquals(self.search(self.users['u_r'], q='borrower LOAN'), [twice.document_id, once.document_id])
+        self.assertEquals(self.search(self.users['u_r'], q='borrower unknownterm'), [])
+
+    def test_search_scoped_to_lender_and_active(self):
+        other_lender_document = LenderDocument.objects.create(lender=Lender.objects.create(name='other'), name='other')
+        Document.create(other_lender_document, self.users['u_rwx'], 'shared clause')
+        draft = Document.create(self.lender_document, self.users['u_rwx'], 'shared clause')
+        self.assertEquals(self.search(self.users['u_r'], q='clause'), [draft.document_id])
+        self.assertEquals(self.search(self.users['u_r'], q='clause', active_only='true'), [])
+        published = draft.publish()
+        self.assertEquals(self.search(self.users['u_r'], q='clause', active_only='true'), [published.document_id])
+
+    def test_index_documents_backfills(self):
+        document = self.lender_document.documents.all()[0]
+        document.terms.all().delete()
+        self.assertEquals(self.search(self.users['u_r'], q='testdocumentcontent'), [])
+        call_command('index_documents', '--batch-size', '1', stdout=open(os.devnull, 'w'))
+        self.assertEquals(self.search(self.users['u_r'], q='testdocumentcontent'), [document.document_id])
+
+    def test_streamed_upload_indexed_later(self):
+        url = reverse('document-upload') + '?lender_document_id={}'.format(self.lender_document.lender_document_id)
+        self.client.force_authenticate(user=self.users['u_rw'])
+        response = self.client.generic('POST', url, b'streamedterm', content_type='text/plain')
+        self.assertEquals(response.status_code, 201)
+        document_id = json.loads(response.content.decode('utf-8'))['document_id']
+        self.assertEquals(self.search(self.users['u_r'], q='streamedterm'), [])
+        self.client.force_authenticate(user=self.users['u_rw'])
+        response = self.client.generic('POST', url, b'\xff\xfe', content_type='text/plain')
+        self.assertEquals(response.status_code, 201)
+        call_command('index_documents', stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+        self.assertEquals(self.search(self.users['u_r'], q='streamedterm'), [document_id])
+
+    def test_import_documents(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lender_directory = os.path.join(directory, 'documents', str(self.lender_document.lender_document_id))
+            os.makedirs(lender_directory)
+            for name, content in (('1.txt', 'FIRST'), ('2.txt', 'SECOND'), ('3.pdf', '%PDF')):
+                with open(os.path.join(lender_directory, name), 'w') as f:
+                    f.write(content)
+            args = (os.path.join(directory, 'documents'), '--user', 'u_rw', '--batch-size', '2')
+            call_command('import_documents', *args, stdout=open(os.devnull, 'w'))
+            call_command('import_documents', *args, stdout=open(os.devnull, 'w'))
+
+        imported = list(self.lender_document.documents.order_by('version_minor')[1:])
+        self.assertEquals([(d.version_major, d.version_minor) for d in imported], [(0, 2), (0, 3), (0, 4)])
+        self.assertEquals([d.content_type for d in imported], ['text/plain', 'text/plain', 'application/pdf'])
+        self.assertEquals([d.get_content() for d in imported[:2]], ['FIRST', 'SECOND'])
+        self.assertEquals(imported[0].content_digest, Document.digest('FIRST'))
+        self.assertEquals(imported[2].open_content().read(), b'%PDF')
+        self.assertEquals(imported[0].created_by, self.users['u_rw'])
+        self.assertEquals({d.lender_id for d in self.lender_document.documents.all()}, {self.lender.lender_id})
+        self.lender_document.refresh_from_db()
+        self.assertEquals(self.lender_document.latest_version_minor, 4)
+
+    def test_import_documents_resumes_pending_batch(self):
+        lender_document_id = self.lender_document.lender_document_id
+        with tempfile.TemporaryDirectory() as directory:
+            lender_directory = os.path.join(directory, 'documents', str(lender_document_id))
+            os.makedirs(lender_directory)
+            for name in ('1.txt', '2.txt'):
+                with open(os.path.join(lender_directory, name), 'w') as f:
+                    f.write(name)
+            args = (os.path.join(directory, 'documents'), '--user', 'u_rw')
+            call_command('import_documents', *args, stdout=open(os.devnull, 'w'))
+            # Interrupted after the batch was committed, then after it was rolled back
+            progress_file = os.path.join(directory, 'documents.progress')
+            with open(progress_file, 'w') as f:
+                json.dump({'completed': 0, 'pending': [[lender_document_id, 0, 2], [lender_document_id, 0, 3]]}, f)
+            call_command('import_documents', *args, stdout=open(os.devnull, 'w'))
+            self.assertEquals(self.lender_document.documents.count(), 3)
+            with open(progress_file, 'w') as f:
+                json.dump({'completed': 0, 'pending': [[lender_document_id, 0, 8], [lender_document_id, 0, 9]]}, f)
+            call_command('import_documents', *args, stdout=open(os.devnull, 'w'))
+            self.assertEquals(self.lender_document.documents.count(), 5)
+
+    def test_export_documents_zip(self):
+        Document.create(self.lender_document, self.users['u_rwx'], 'SECOND').publish()
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(reverse('document-export'), {'active_only': 'true'})
+        self.assertEquals(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        manifest = json.loads(archive.read('manifest.json').decode())
+        self.assertEquals(len(manifest), 1)
+        self.assertEquals((manifest[0]['version_major'], manifest[0]['version_minor']), (1, 0))
+        self.assertEquals(archive.read(manifest[0]['path']), b'SECOND')
+
+    def test_export_documents_command_tar(self):
+        Document.create(self.lender_document, self.users['u_rwx'], 'SECOND')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.tar')
+            call_command('export_documents', path, '--archive', 'tar', '--lender', str(self.lender.lender_id),
+                         stdout=open(os.devnull, 'w'))
+            with tarfile.open(path) as archive:
+                manifest = json.loads(archive.extractfile('manifest.json').read().decode())
+                contents = [archive.extractfile(d['path']).read() for d in manifest]
+        self.assertEquals(contents, [b'TESTDOCUMENTCONTENT', b'SECOND'])
+
+    @override_settings(DOCUMENT_STREAM_CHUNK_SIZE=16)
+    def test_export_manifest_streamed(self):
+        Document.create(self.lender_document, self.users['u_rwx'], 'SECOND')
+        documents = Document.objects.select_related('lender_document').order_by('document_id')
+        # The manifest is copied into each archive 16 bytes at a time
+        with tarfile.open(fileobj=io.BytesIO(b''.join(export_documents(documents.iterator(), 'tar')))) as archive:
+            manifest = json.loads(archive.extractfile('manifest.json').read().decode())
+            self.assertEquals(archive.extractfile(manifest[1]['path']).read(), b'SECOND')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(export_documents(documents.iterator(), 'zip'))))
+        self.assertEquals(json.loads(archive.read('manifest.json').decode()), manifest)
+
+    @override_settings(DOCUMENT_DIRECT_TRANSFER=True)
+    def test_direct_upload_and_download(self):
+        self.client.force_authenticate(user=self.users['u_rw'])
+        response = self.client.post(reverse('document-list'), {
+            'lender_document_id': self.lender_document.lender_document_id, 'content_type': 'text/plain'
+        })
+        self.assertEquals(response.status_code, 202)
+        upload = json.loads(response.content.decode('utf-8'))
+        self.client.force_authenticate(user=None)
+        response = self.client.put(upload['upload_url'], b'UPLOADED', content_type='text/plain')
+        self.assertEquals(response.status_code, 201)
+
+        self.client.force_authenticate(user=self.users['u_rw'])
+        response = self.client.post(reverse('document-confirm-upload'), {'upload_token': upload['upload_token']})
+        self.assertEquals(response.status_code, 201)
+        document_id = json.loads(response.content.decode('utf-8'))['document_id']
+        self.client.post(reverse('document-confirm-upload'), {'upload_token': upload['upload_token']})
+        self.assertEquals(self.lender_document.documents.count(), 2)
+
+        retrieved = json.loads(self.client.get(reverse('document-detail', kwargs={'pk': document_id})).content.decode('utf-8'))
+        self.assertIsNone(retrieved['content'])
+        self.client.force_authenticate(user=None)
+        response = self.client.get(retrieved['content_url'])
+        self.assertEquals(b''.join(response.streaming_content), b'UPLOADED')
+        self.assertEquals(self.client.put(retrieved['content_url'], b'X', content_type='text/plain').status_code, 405)
+
+    @override_settings(DOCUMENT_DIRECT_TRANSFER=True)
+    def test_confirm_upload_requires_upload(self):
+        self.client.force_authenticate(user=self.users['u_rw'])
+        upload = json.loads(self.client.post(reverse('document-list'), {
+            'lender_document_id': self.lender_document.lender_document_id
+        }).content.decode('utf-8'))
+        response = self.client.post(reverse('document-confirm-upload'), {'upload_token': upload['upload_token']})
+        self.assertEquals(response.status_code, 400)
+        self.client.force_authenticate(user=self.users['u_rwx'])
+        response = self.client.post(reverse('document-confirm-upload'), {'upload_token': upload['upload_token']})
+        self.assertEquals(response.status_code, 400)
+
+    @override_settings(DOCUMENT_DIRECT_TRANSFER=True)
+    def test_direct_upload_scoped_to_lender(self):
+        self.client.force_authenticate(user=self.users['u_rw'])
+        upload = json.loads(self.client.post(reverse('document-list'), {
+            'lender_document_id': self.lender_document.lender_document_id
+        }).content.decode('utf-8'))
+        get_document_repository().put(load_token(upload['upload_token'], UPLOAD_SALT)['key'], 'UPLOADED')
+
+        other_lender = Lender.objects.create(name='other_lender_name')
+        other_lender_document = LenderDocument.objects.create(lender=other_lender, name='other_lender_document')
+        response = self.client.post(reverse('document-list'), {
+            'lender_document_id': other_lender_document.lender_document_id
+        })
+        self.assertEquals(response.status_code, 400)
+
+        user = self.users['u_rw']
+        user.profile.lender = other_lender
+        user.save()
+        self.client.force_authenticate(user=User.objects.get(pk=user.pk))
+        response = self.client.post(reverse('document-confirm-upload'), {'upload_token': upload['upload_token']})
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(self.lender_document.documents.count(), 1)
+
+    @override_settings(DOCUMENT_DIRECT_TRANSFER=True)
+    def test_download_url_response_not_revalidated(self):
+        document = self.lender_document.documents.all()[0]
+        url = reverse('document-detail', kwargs={'pk': document.document_id})
+        self.client.force_authenticate(user=self.users['u_r'])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('ETag'))
+        etag = self.client.get(url, {'transfer': 'inline'})['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('content_url', json.loads(response.content.decode('utf-8')))
+
+    @override_settings(DOCUMENT_DOWNLOAD_URL_EXPIRES=-1, DOCUMENT_DIRECT_TRANSFER=True)
+    def test_expired_download_url(self):
+        document = self.lender_document.documents.all()[0]
+        self.client.force_authenticate(user=self.users['u_r'])
+        retrieved = json.loads(self.client.get(reverse('document-detail', kwargs={'pk': document.document_id})).content.decode('utf-8'))
+        self.assertEquals(self.client.get(retrieved['content_url']).status_code, 403)
+        inline = self.client.get(reverse('document-detail', kwargs={'pk': document.document_id}), {'transfer': 'inline'})
+        self.assertEquals(json.loads(inline.content.decode('utf-8'))['content'], 'TESTDOCUMENTCONTENT')
+
+
+class VersionAllocationTests(TransactionTestCase):
+    threads = 8
+    documents_per_thread = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Concurrent transactions need a file or server backed test database')
+
+    def test_concurrent_drafts_and_publishes(self):
+        lender_document = LenderDocument.objects.create(lender=Lender.objects.create(name='lender'), name='concurrent')
+        errors = []
+
+        def draft(worker):
+            try:
+                for i in range(self.documents_per_thread):
+                    document = Document.create(
+                        LenderDocument.objects.get(pk=lender_document.pk), None, 'DRAFT {} {}'.format(worker, i)
+                    )
+                    if i % 5 == 4:
+                        Document.objects.get(pk=document.pk).publish()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=draft, args=(n,)) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEquals(errors, [])
+        # Every draft, and a new version for each publish after the first
+        versions = list(Document.objects.filter(lender_document=lender_document).values_list('version_major', 'version_minor'))
+        self.assertEquals(len(versions), self.threads * self.documents_per_thread * 6 // 5 - 1)
+        self.assertEquals(len(versions), len(set(versions)))
+        lender_document.refresh_from_db()
+        majors = sorted({major for major, _ in versions})
+        self.assertEquals(majors, list(range(majors[0], lender_document.latest_version_major + 1)))
+        self.assertEquals(lender_document.active_document.version_major, lender_document.latest_version_major)
+
+
+# The test process is the only one, so a local-memory principal cache is shared
+@override_settings(PRINCIPAL_CACHE='default')
+class QueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        p_r = Permission.objects.get(codename='read_document')
+        self.lender = Lender.objects.create(name='test_lender_name')
+        user = User.objects.create_user(username='u_r', password='u_r')
+        user.user_permissions.set([p_r])
+        user.profile.lender = self.lender
+        user.save()
+        for i in range(3):
+            lender_document = LenderDocument.objects.create(lender=self.lender, name='type {}'.format(i))
+            for j in range(5):
+                document = Document.create(lender_document=lender_document, created_user=user, content='CONTENT')
+            document.publish()
+
+    def authenticate(self):
+        # A fresh instance so permission and profile caches start empty
+        self.client.force_authenticate(user=User.objects.get(username='u_r'))
+
+    def test_list_document_query_count(self):
+        self.authenticate()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('document-list'))
+        self.assertEquals(len(json.loads(response.content.decode('utf-8'))['results']), 15)
+
+    def test_retrieve_document_query_count(self):
+        document = Document.objects.all()[0]
+        self.authenticate()
+        with self.assertNumQueries(4):
+            self.client.get(reverse('document-detail', kwargs={'pk': document.document_id}))
+
+    def test_list_lender_document_query_count(self):
+        self.authenticate()
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('lenderdocument-list'))
+        self.assertEquals(len(json.loads(response.content.decode('utf-8'))['results']), 3)
+
+    def test_warm_principal_skips_authorization_queries(self):
+        self.authenticate()
+        self.client.get(reverse('document-list'))
+        self.authenticate()
+        with self.assertNumQueries(2):
+            self.client.get(reverse('document-list'))
+
+    def test_warm_token_authentication_runs_no_queries(self):
+        response = self.client.post('/api/api-token-auth/', {'username': 'u_r', 'password': 'u_r'}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + response.data['token'])
+        self.client.get(reverse('document-list'))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('document-list'))
+        self.assertEquals(response.status_code, 200)
+
+    def test_permission_change_invalidates_principal(self):
+        self.authenticate()
+        self.assertEquals(self.client.get(reverse('document-list')).status_code, 200)
+        User.objects.get(username='u_r').user_permissions.clear()
+        self.authenticate()
+        self.assertEquals(self.client.get(reverse('document-list')).status_code, 403)
+
+    def test_local_memory_principal_cache_refused(self):
+        self.assertEquals([error.id for error in check_principal_cache(None)], ['api.E001'])
+        with override_settings(PRINCIPAL_CACHE=None):
+            self.assertEquals(check_principal_cache(None), [])
+
+    def test_query_budget_exceeded(self):
+        self.authenticate()
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                self.client.get(reverse('document-list'))
+
+    @override_settings(MIDDLEWARE=['api.middleware.QueryBudgetMiddleware'], QUERY_BUDGET=1, QUERY_BUDGET_STRICT=True)
+    def test_query_budget_middleware(self):
+        self.authenticate()
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('document-list'))
+
+
+@override_settings(DOCUMENT_REPOSITORY_BACKEND='memory')
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_document_repository()
+
+    def tearDown(self):
+        reset_document_repository()
+
+    def test_run_benchmark(self):
+        result = run_benchmark(lenders=2, document_types=1, versions=6, lines=10, requests=3, warmup=1)
+        self.assertEquals(set(result['endpoints']), {'list', 'retrieve', 'create', 'publish', 'revert'})
+        for measurement in result['endpoints'].values():
+            self.assertEquals(sum(measurement['statuses'].values()), 3)
+            self.assertTrue(all(status.startswith('2') for status in measurement['statuses']))
+            self.assertGreater(measurement['queries']['max'], 0)
+
+
+class LenderDocumentListTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_document_repository()
+        self.user = User.objects.create_user(username='u', password='u', email='u')
+        self.user.user_permissions.set(Permission.objects.filter(codename='read_document'))
+        self.user.profile.lender = Lender.objects.create(name='test_lender_name')
+        self.user.save()
+        for name in ['terms', 'terms_fr', 'privacy', 'fees']:
+            LenderDocument.objects.create(lender=self.user.profile.lender, name=name)
+        lender_document = LenderDocument.objects.get(name='terms')
+        self.active_document = Document.create(lender_document, self.user, 'TESTDOCUMENTCONTENT').publish()
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        reset_document_repository()
+
+    def list(self, **params):
+        response = self.client.get(reverse('lenderdocument-list'), params)
+        self.assertEquals(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_paginated(self):
+        page = self.list(limit=3)
+        self.assertEquals(page['count'], 4)
+        self.assertEquals(len(page['results']), 3)
+        # Ordered by last update, so the published type comes last
+        self.assertEquals(self.list()['results'][-1], {
+            'lender_document_id': self.active_document.lender_document_id,
+            'name': 'terms',
+            'active_version': 1,
+            'active_document_id': self.active_document.document_id,
+        })
+
+    def test_cursor_pagination(self):
+        names = []
+        page = self.list(pagination='cursor', limit=3)
+        names += [row['name'] for row in page['results']]
+        page = self.client.get(page['next']).json()
+        names += [row['name'] for row in page['results']]
+        self.assertIsNone(page['next'])
+        self.assertEquals(sorted(names), ['fees', 'privacy', 'terms', 'terms_fr'])
+
+    def test_filters(self):
+        self.assertEquals({row['name'] for row in self.list(name='terms')['results']}, {'terms', 'terms_fr'})
+        self.assertEquals([row['name'] for row in self.list(has_active='true')['results']], ['terms'])
+        self.assertEquals(len(self.list(has_active='false')['results']), 3)
+        self.assertEquals(self.list(updated_since='2000-01-01T00:00:00Z')['count'], 4)
+        self.assertEquals(self.list(updated_since='2999-01-01T00:00:00Z')['count'], 0)
+        response = self.client.get(reverse('lenderdocument-list'), {'updated_since': 'yesterday'})
+        self.assertEquals(response.status_code, 400)
+
+    def test_sparse_fields(self):
+        rows = self.list(fields='lender_document_id,active_version')['results']
+        self.assertEquals(rows[-1], {'lender_document_id': self.active_document.lender_document_id, 'active_version': 1})
+        response = self.client.get(reverse('lenderdocument-list'), {'fields': 'lender_document_id,lender'})
+        self.assertEquals(response.status_code, 400)
+
+
+class ValuesSerializationTests(TestCase):
+    def setUp(self):
+        reset_document_repository()
+        lender = Lender.objects.create(name='test_lender_name')
+        user = User.objects.create_user(username='u', password='u', email='u')
+        published = LenderDocument.objects.create(lender=lender, name='published')
+        Document.create(published, user, 'TESTDOCUMENTCONTENT').publish()
+        Document.create(published, None, 'TESTDOCUMENTCONTENT2')
+        LenderDocument.objects.create(lender=lender, name='unpublished')
+
+    def tearDown(self):
+        reset_document_repository()
+
+    def test_document_parity(self):
+        documents = Document.objects.select_related('created_by').order_by('document_id')
+        self.assertEquals(
+            json.dumps(serialize_document_values(documents.values(*DOCUMENT_VALUES))),
+            json.dumps(DocumentSerializer(documents, many=True).data)
+        )
+
+    def test_lender_document_parity(self):
+        lender_documents = LenderDocument.objects.select_related('active_document').order_by('lender_document_id')
+        self.assertEquals(
+            json.dumps(serialize_lender_document_values(lender_documents.values(*LENDER_DOCUMENT_VALUES))),
+            json.dumps(LenderDocumentSerializer(lender_documents, many=True).data)
+        )
+
+
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        lender = Lender.objects.create(name='test_lender_name')
+        self.user = User.objects.create_user(username='u', password='u', email='u')
+        self.user.user_permissions.set(Permission.objects.filter(codename='read_document'))
+        self.user.profile.lender = lender
+        self.user.save()
+        lender_document = LenderDocument.objects.create(lender=lender, name='test_lender_document')
+        self.document = Document.create(lender_document, self.user, 'TESTDOCUMENTCONTENT')
+
+    def test_server_timing_header(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('document-detail', kwargs={'pk': self.document.document_id}))
+        metric_names = [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+        self.assertEquals(metric_names, ['db', 'render', 'serialize', 'storage', 'total'])
+
+    def test_metrics_endpoint(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get(reverse('document-list'))
+        self.assertEquals(self.client.get(reverse('metrics')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        endpoints = json.loads(self.client.get(reverse('metrics')).content.decode('utf-8'))['endpoints']
+        histograms = endpoints['GET document-list']
+        self.assertEquals(histograms['total']['count'], 1)
+        self.assertEquals(sum(histograms['db']['buckets'].values()), 1)
+        self.assertIn('serialize', histograms)
+
+
+class ImportTimeTests(TestCase):
+    def test_wsgi_import_does_not_load_boto3(self):
+        output = io.StringIO()
+        call_command('importtime', '--json', stdout=output)
+        modules = [record['module'] for record in json.loads(output.getvalue())['imports']]
+        self.assertIn('api.models', modules)
+        self.assertNotIn('boto3', modules)
+
+
+class CachedDocumentRepositoryTests(TestCase):
+    def setUp(self):
+        self.backend = InMemoryDocumentRepository()
+        self.repository = CachedDocumentRepository(self.backend, max_bytes=10)
+
+    def test_get_is_cached(self):
+        self.repository.put('a', 'AAAA')
+        self.assertEquals(self.repository.get('a'), 'AAAA')
+        self.assertEquals(self.repository.get('a'), 'AAAA')
+        self.assertEquals(self.backend.gets, 1)
+        self.assertEquals(self.repository.hits, 1)
+        self.assertEquals(self.repository.misses, 1)
+
+    def test_least_recently_used_evicted_over_budget(self):
+        for key in ('a', 'b', 'c'):
+            self.repository.put(key, key * 4)
+        self.repository.get('a')
+        self.repository.get('b')
+        self.repository.get('a')
+        self.repository.get('c')
+        self.assertEquals(self.repository.evictions, 1)
+        self.assertEquals(self.repository.stats()['bytes'], 8)
+        self.repository.get('b')
+        self.assertEquals(self.backend.gets, 4)
+
+    def test_put_invalidates(self):
+        self.repository.put('a', 'old')
+        self.repository.get('a')
+        self.repository.put('a', 'new')
+        self.assertEquals(self.repository.get('a'), 'new')
+
+    def test_oversized_content_not_cached(self):
+        self.repository.put('a', 'A' * 11)
+        self.repository.get('a')
+        self.repository.get('a')
+        self.assertEquals(self.backend.gets, 2)
+        self.assertEquals(self.repository.stats()['entries'], 0)
+
+
+@override_settings(DOCUMENT_DELTA_SNAPSHOT_INTERVAL=3)
+class DeltaStorageTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_reconstructed_contents()
+        self.user = User.objects.create_user(username='u', password='u', email='u')
+        self.user.user_permissions.set(Permission.objects.filter(codename='read_document'))
+        self.user.profile.lender = Lender.objects.create(name='test_lender_name')
+        self.user.save()
+        self.lender_document = LenderDocument.objects.create(lender=self.user.profile.lender, name='test_lender_document')
+        lines = ['clause {}\n'.format(i) for i in range(50)]
+        self.contents = []
+        self.documents = []
+        for i in range(7):
+            lines[i * 3] = 'amended clause {}\n'.format(i)
+            self.contents.append(''.join(lines))
+            self.documents.append(Document.create(self.lender_document, self.user, self.contents[-1]))
+
+    def forget_contents(self):
+        get_document_repository().clear()
+        reset_reconstructed_contents()
+
+    def test_snapshot_every_interval(self):
+        self.assertEquals([d.delta_depth for d in self.documents], [0, 1, 2, 0, 1, 2, 0])
+        self.assertEquals(self.documents[2].delta_base_id, self.documents[1].document_id)
+        self.assertIsNone(self.documents[3].delta_base_id)
+
+    def test_reconstructs_contents(self):
+        self.forget_contents()
+        for document, content in zip(Document.objects.order_by('document_id'), self.contents):
+            self.assertEquals(document.get_content(), content)
+
+    def test_reconstructed_contents_cached(self):
+        self.forget_contents()
+        document = Document.objects.get(document_id=self.documents[5].document_id)
+        document.get_content()
+        self.assertIn(document.content_digest, get_reconstructed_contents())
+        self.assertEquals(Document.objects.get(document_id=document.document_id).get_content(), self.contents[5])
+
+    def test_get_contents_reconstructs_concurrently(self):
+        self.forget_contents()
+        contents, errors = Document.get_contents(list(Document.objects.order_by('document_id')))
+        self.assertEquals(errors, {})
+        self.assertEquals([contents[d.document_id] for d in self.documents], self.contents)
+
+    def test_revert_to_delta_version(self):
+        self.documents[4].revert(self.user)
+        self.forget_contents()
+        self.assertEquals(self.lender_document.documents.latest('document_id').get_content(), self.contents[4])
+
+    def test_content_endpoint_returns_full_body(self):
+        self.forget_contents()
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('document-content', kwargs={'pk': self.documents[2].document_id}))
+        self.assertEquals(b''.join(response.streaming_content).decode(), self.contents[2])
+
+    def test_delta_round_trip(self):
+        base = 'a\nb\nc\nd\n'
+        content = 'a\nB\nc\nd\ne\n'
+        self.assertEquals(apply_delta(base, make_delta(base, content)), content)
+        self.assertEquals(
+            diff_opcodes(base.splitlines(), content.splitlines()),
+            [('equal', 0, 1, 0, 1), ('replace', 1, 2, 1, 2), ('equal', 2, 4, 2, 4), ('insert', 4, 4, 4, 5)]
+        )
+
+    def test_large_document_delta_bounded(self):
+        lines = ['clause {} of the agreement\n'.format(i) for i in range(5000)]
+        base = ''.join(lines)
+        content = ''.join('amended ' + line if i % 3 == 0 else line for i, line in enumerate(lines))
+        started = time.perf_counter()
+        delta = make_delta(base, content)
+        self.assertLess(time.perf_counter() - started, 5)
+        self.assertEquals(apply_delta(base, delta), content)
+        self.assertLess(len(delta), len(content))
+
+        # Unrelated bodies exhaust the work budget and become one replacement
+        unrelated = ''.join('{}\n'.format(i % 7) for i in range(20000))
+        started = time.perf_counter()
+        self.assertEquals(apply_delta(base, make_delta(base, unrelated)), unrelated)
+        self.assertLess(time.perf_counter() - started, 5)
+
+
+class LocalDocumentRepositoryTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.repository = LocalDocumentRepository(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_is_sharded(self):
+        self.repository.put('local/1-terms_0_1', 'CONTENT')
+        path = self.repository.path('local/1-terms_0_1')
+        self.assertEquals(os.path.relpath(path, self.directory.name).split(os.sep)[0], 'local')
+        self.assertEquals(len(os.path.relpath(path, self.directory.name).split(os.sep)), 4)
+        self.assertEquals(self.repository.get('local/1-terms_0_1'), 'CONTENT')
+        self.assertEquals(os.listdir(os.path.dirname(path)), ['1-terms_0_1'])
+
+    def test_failed_write_leaves_nothing(self):
+        with self.assertRaises(ValueError):
+            with self.repository.open_write('local/1-terms_0_1') as f:
+                f.write(b'PARTIAL')
+                self.assertFalse(self.repository.exists('local/1-terms_0_1'))
+                raise ValueError()
+        self.assertFalse(self.repository.exists('local/1-terms_0_1'))
+        self.assertEquals(os.listdir(os.path.dirname(self.repository.path('local/1-terms_0_1'))), [])
+
+    def test_reads_legacy_layout(self):
+        os.makedirs(os.path.join(self.directory.name, 'local'))
+        with open(os.path.join(self.directory.name, 'local', '1-terms_0_1'), 'w') as f:
+            f.write('LEGACY')
+        self.assertTrue(self.repository.exists('local/1-terms_0_1'))
+        self.assertEquals(self.repository.get('local/1-terms_0_1'), 'LEGACY')
+
+
+@override_settings(DOCUMENT_REPOSITORY_BACKEND='memory', DOCUMENT_WRITE_BEHIND=True)
+class WriteBehindTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        reset_document_repository()
+        self.user = User.objects.create_user(username='u', password='u', email='u')
+        self.user.user_permissions.set(Permission.objects.filter(codename__in=['read_document', 'draft_document']))
+        self.user.profile.lender = Lender.objects.create(name='test_lender_name')
+        self.user.save()
+        self.lender_document = LenderDocument.objects.create(lender=self.user.profile.lender, name='test_lender_document')
+
+    def tearDown(self):
+        reset_document_repository()
+
+    def test_create_spools_body(self):
+        document = Document.create(self.lender_document, self.user, 'TESTDOCUMENTCONTENT')
+        self.assertEquals(document.storage_state, Document.PENDING)
+        self.assertFalse(get_document_repository().exists(document.s3_bucket_key))
+        self.assertEquals(Document.objects.get(document_id=document.document_id).get_content(), 'TESTDOCUMENTCONTENT')
+
+    def test_pending_document_served_from_spool(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('document-list'), {
+            'lender_document_id': self.lender_document.lender_document_id,
+            'content': 'TESTDOCUMENTCONTENT'
+        }, format='json')
+        self.assertEquals(response.status_code, status.HTTP_201_CREATED)
+        document_id = json.loads(response.content)['document_id']
+        response = self.client.get(reverse('document-detail', kwargs={'pk': document_id}))
+        self.assertEquals(json.loads(response.content)['content'], 'TESTDOCUMENTCONTENT')
+
+    def test_drain_spool(self):
+        document = Document.create(self.lender_document, self.user, 'TESTDOCUMENTCONTENT')
+        Document.create(self.lender_document, self.user, 'TESTDOCUMENTCONTENT2')
+        published = document.publish()
+        self.assertEquals(drain_spool(), (2, 0))
+        self.assertEquals(drain_spool(), (0, 0))
+        self.assertFalse(SpooledBody.objects.exists())
+        self.assertFalse(Document.objects.filter(storage_state=Document.PENDING).exists())
+        self.assertEquals(get_document_repository().get(published.s3_bucket_key), 'TESTDOCUMENTCONTENT')
+        self.assertEquals(Document.objects.get(document_id=published.document_id).get_content(), 'TESTDOCUMENTCONTENT')
+
+
+@override_settings(DATABASE_REPLICAS=['test'])
+class ReplicaRoutingTests(APITransactionTestCase):
+    # Reads inside a transaction on the primary stay there, so this cannot run
+    # in TestCase's per-test transaction
+    multi_db = True
+
+    def setUp(self):
+        cache.clear()
+        replica_health.reset()
+        reset_document_repository()
+        self.user = User.objects.create_user(username='u', password='u', email='u')
+        self.user.user_permissions.set(Permission.objects.filter(codename__in=['read_document', 'draft_document']))
+        self.user.profile.lender = Lender.objects.create(name='test_lender_name')
+        self.user.save()
+        self.lender_document = LenderDocument.objects.create(lender=self.user.profile.lender, name='test_lender_document')
+        self.client.force_authenticate(user=self.user)
+
+    def tearDown(self):
+        reset_document_repository()
+
+    def replica_queries(self, url):
+        with CaptureQueriesContext(connections['test']) as queries:
+            response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        return len(queries)
+
+    def test_reads_from_replica(self):
+        self.assertGreater(self.replica_queries(reverse('document-list')), 0)
+        self.assertGreater(self.replica_queries(reverse('lenderdocument-list')), 0)
+
+    def test_writer_reads_from_primary(self):
+        response = self.client.post(reverse('document-list'), {
+            'lender_document_id': self.lender_document.lender_document_id,
+            'content': 'TESTDOCUMENTCONTENT'
+        }, format='json')
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(self.replica_queries(reverse('document-list')), 0)
+        # The pin is carried by the client, not the container that served the write
+        self.assertIn(settings.DATABASE_REPLICA_STICKY_COOKIE, response.cookies)
+        self.client.cookies.clear()
+        self.assertGreater(self.replica_queries(reverse('document-list')), 0)
+
+    def test_principal_resolved_on_primary(self):
+        with CaptureQueriesContext(connections['test']) as queries:
+            self.client.get(reverse('document-list'))
+        self.assertFalse([query for query in queries.captured_queries if 'api_profile' in query['sql']])
+
+    @override_settings(DATABASE_REPLICAS=['test', 'default'])
+    def test_round_robin(self):
+        router = ReplicaRouter()
+        with replica_reads():
+            self.assertEquals([router.db_for_read(Document) for _ in range(3)], ['test', 'default', 'test'])
+        self.assertEquals(router.db_for_read(Document), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['missing', 'test'])
+    def test_unhealthy_replica_skipped(self):
+        router = ReplicaRouter()
+        with replica_reads():
+            self.assertEquals([router.db_for_read(Document) for _ in range(2)], ['test', 'test'])
@@ -0,0 +1,34 @@
+import time
+
+from django.core import signing
+from django.urls import reverse
+
+# Signed, expiring tokens for direct transfers of document bodies. Transfer
+# tokens authorise one method on one stored key and back the transfer view that
+# stands in for S3 presigned URLs with repositories other than S3. Upload
+# tokens let the uploader register the version once the body is in place.
+
+TRANSFER_SALT = 'api.transfer'
+UPLOAD_SALT = 'api.transfer.upload'
+
+
+def make_token(payload, expires_in, salt):
+    return signing.dumps(dict(payload, expires=int(time.time()) + expires_in), salt=salt)
+
+
+def load_token(token, salt):
+    # Raises signing.BadSignature for tampered or expired tokens
+    payload = signing.loads(token, salt=salt)
+    if payload['expires'] < time.time():
+        raise signing.BadSignature('Token expired')
+    return payload
+
+
+def signed_transfer_url(key, method, expires_in, content_type=None, content_encoding=None):
+    token = make_token({
+        'key': key,
+        'method': method,
+        'content_type': content_type,
+        'content_encoding': content_encoding,
+    }, expires_in, TRANSFER_SALT)
+    return reverse('document-transfer', kwargs={'token': token})
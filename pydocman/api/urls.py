@@ -13,6 +13,8 @@ router.register(r'lenderdocument', views.LenderDocumentViewSet, base_name='lende
 
 urlpatterns = [
     url(r'^test/$', views.test),
+    url(r'^metrics/$', views.metrics_view, name='metrics'),
+    url(r'^transfer/(?P<token>[^/]+)/$', views.transfer, name='document-transfer'),
     url(r'^api-token-auth/', obtain_jwt_token),
     url(r'^api-token-refresh/', refresh_jwt_token),
     url(r'^', include(router.urls))
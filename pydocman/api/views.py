@@ -1,26 +1,44 @@
-import boto3
-
-from django.http import JsonResponse
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import mixins, viewsets
-from rest_framework_jwt.authentication import JSONWebTokenAuthentication
-from rest_framework.decorators import detail_route
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.decorators import api_view, detail_route, list_route, permission_classes
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
+from .activecontent import get_active_content
+from .authentication import CachedJSONWebTokenAuthentication
+from .diff import GRANULARITIES
+from .documentrepository import get_document_repository
+from .export import ARCHIVE_CONTENT_TYPES, export_documents
+from .instrumentation import JsonResponse, metrics
 from .models import Document, LenderDocument
+from .pagination import KeysetPagination, LenderDocumentKeysetPagination
 from .permissions import DocumentModelPermission, DocumentModelPublishPermission, DocumentModelRevertPermission, LenderDocumentModelPermission
-from .serializers import DocumentSerializer, LenderDocumentSerializer
-
-
-s3 = boto3.client('s3')
+from .principal import get_principal
+from .routers import ReplicaReadMixin
+from .search import search_documents
+from .serializers import (
+    DOCUMENT_VALUES, LENDER_DOCUMENT_FIELDS, DocumentSerializer, LenderDocumentSerializer,
+    lender_document_values, serialize_document_values, serialize_lender_document_values
+)
+from .transfer import TRANSFER_SALT, UPLOAD_SALT, load_token, make_token
 
 
-class DocumentViewSet(mixins.CreateModelMixin,
+class DocumentViewSet(ReplicaReadMixin,
+                      mixins.CreateModelMixin,
                       mixins.ListModelMixin,
                       mixins.RetrieveModelMixin,
                       viewsets.GenericViewSet):
-    authentication_classes = (JSONWebTokenAuthentication,)
+    authentication_classes = (CachedJSONWebTokenAuthentication,)
     permission_classes = (DocumentModelPermission,)
+    batch_max_ids = 100
 
     def list(self, request):
         documents = self.get_queryset().all()
@@ -31,30 +49,226 @@ class DocumentViewSet(mixins.CreateModelMixin,
         if state == 'published':
             documents = documents.filter(version_minor=0)
 
-        documents = self.paginate_queryset(documents)
-        serializer = DocumentSerializer(documents, many=True)
-        return self.get_paginated_response(serializer.data)
+        if uses_keyset_pagination(request):
+            self._paginator = KeysetPagination()
+        documents = self.paginate_queryset(documents.values(*DOCUMENT_VALUES))
+        return self.get_paginated_response(serialize_document_values(documents))
         
     def create(self, request):
         try:
             lender_document_id = request.data['lender_document_id']
-            lender_document = LenderDocument.objects.get(lender_document_id=lender_document_id)
-            content = request.data['content']
+            lender_document = self.get_lender_documents().get(lender_document_id=lender_document_id)
+            content = request.data.get('content')
         except:
             return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        if content is None:
+            if not settings.DOCUMENT_DIRECT_TRANSFER:
+                return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+            return self.start_upload(request, lender_document)
         document = Document.create(lender_document, request.user, content)
         serializer = DocumentSerializer(document, many=False)
         return JsonResponse(serializer.data, status=201, safe=False)
 
+    def start_upload(self, request, lender_document):
+        # The client PUTs the body to upload_url with upload_headers, then
+        # registers the version by posting upload_token to confirm_upload
+        content_type = request.data.get('content_type') or 'application/octet-stream'
+        s3_bucket_key = Document.upload_key(lender_document)
+        expires_in = settings.DOCUMENT_UPLOAD_URL_EXPIRES
+        upload_url = get_document_repository().presigned_url(s3_bucket_key, 'PUT', expires_in, content_type)
+        upload_token = make_token({
+            'key': s3_bucket_key,
+            'lender_document_id': lender_document.lender_document_id,
+            'content_type': content_type,
+            'user_id': request.user.pk,
+        }, expires_in, UPLOAD_SALT)
+        return JsonResponse({
+            'upload_url': request.build_absolute_uri(upload_url),
+            'upload_method': 'PUT',
+            'upload_headers': {'Content-Type': content_type},
+            'upload_token': upload_token,
+            'expires_in': expires_in,
+        }, status=202)
+
+    @list_route(methods=['post'])
+    def confirm_upload(self, request):
+        try:
+            upload = load_token(request.data['upload_token'], UPLOAD_SALT)
+            if upload['user_id'] != request.user.pk:
+                raise ValueError(upload)
+            # The user may have moved to another lender since the upload started
+            lender_document = self.get_lender_documents().get(lender_document_id=upload['lender_document_id'])
+        except:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        # Confirming twice returns the version registered the first time
+        document = Document.objects.filter(s3_bucket_key=upload['key']).first()
+        if document is None:
+            if not get_document_repository().exists(upload['key']):
+                return JsonResponse({'error_msg': 'Upload not found.'}, status=400)
+            document = Document.register_upload(lender_document, request.user, upload['key'], upload['content_type'])
+        serializer = DocumentSerializer(document, many=False)
+        return JsonResponse(serializer.data, status=201, safe=False)
+
     def retrieve(self, request, pk=None):
         try:
             document = self.get_queryset().get(document_id=pk)
         except:
             return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        if uses_download_url(request, document):
+            # No validators, so that a cached response is never revalidated
+            # after its download URL has expired
+            return JsonResponse(serialize_with_content_url(request, document), status=200, safe=False)
+        not_modified = conditional_response(request, document.etag(), document.last_modified())
+        if not_modified:
+            return not_modified
+        response = JsonResponse(serialize_with_content(document), status=200, safe=False)
+        return set_validators(response, document.etag(), document.last_modified())
+
+    @detail_route(methods=['get'])
+    def content(self, request, pk=None):
+        try:
+            document = self.get_queryset().get(document_id=pk)
+        except:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        # Encoded bodies are passed through untouched to clients accepting the encoding
+        passthrough = (
+            document.content_encoding != 'identity' and not document.is_delta() and
+            accepts_encoding(request, document.content_encoding)
+        )
+        etag = document.etag(document.content_encoding if passthrough else None)
+        not_modified = conditional_response(request, etag, document.last_modified())
+        if not_modified:
+            return not_modified
+        if passthrough:
+            response = DocumentContentResponse(document.open_stored_content(), content_type=document.content_type)
+            response['Content-Encoding'] = document.content_encoding
+        else:
+            response = DocumentContentResponse(document.open_content(), content_type=document.content_type)
+        if document.content_encoding != 'identity':
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return set_validators(response, etag, document.last_modified())
+
+    @list_route(methods=['post'])
+    def upload(self, request):
+        # The body is the raw document content, so request.data must not be touched
+        try:
+            lender_document_id = int(request.query_params['lender_document_id'])
+        except:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        try:
+            lender_document = self.get_lender_documents().get(lender_document_id=lender_document_id)
+        except LenderDocument.DoesNotExist:
+            return JsonResponse({'error_msg': 'Not found.'}, status=404)
+        if request.stream is None:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        content_type = request.content_type or 'application/octet-stream'
+        document = Document.create_from_stream(lender_document, request.user, request.stream, content_type)
         serializer = DocumentSerializer(document, many=False)
-        data = serializer.data
-        data['content'] = document.get_content()
-        return JsonResponse(data, status=200, safe=False)
+        return JsonResponse(serializer.data, status=201, safe=False)
+
+    @list_route(methods=['get'])
+    def batch(self, request):
+        ids = [i.strip() for i in request.query_params.get('ids', '').split(',') if i.strip()]
+        if not ids or len(ids) > self.batch_max_ids:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        include_content = request.query_params.get('include_content') in ('1', 'true')
+
+        errors = []
+        document_ids = []
+        for i in ids:
+            try:
+                document_ids.append(int(i))
+            except ValueError:
+                errors.append({'document_id': i, 'error_msg': 'Invalid document id.'})
+        document_ids = list(dict.fromkeys(document_ids))
+        documents = {
+            document.document_id: document
+            for document in self.get_queryset().filter(document_id__in=document_ids)
+        }
+        for document_id in document_ids:
+            if document_id not in documents:
+                errors.append({'document_id': document_id, 'error_msg': 'Document not found.'})
+
+        found = [documents[document_id] for document_id in document_ids if document_id in documents]
+        contents, content_errors = {}, {}
+        if include_content:
+            contents, content_errors = Document.get_contents([d for d in found if d.has_text_content()])
+
+        results = []
+        for document in found:
+            if document.document_id in content_errors:
+                errors.append({'document_id': document.document_id, 'error_msg': 'Could not retrieve content.'})
+                continue
+            data = DocumentSerializer(document, many=False).data
+            if include_content:
+                data['content'] = contents.get(document.document_id)
+            results.append(data)
+        return JsonResponse({'results': results, 'errors': errors}, status=200)
+
+    @list_route(methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        documents = self.get_queryset()
+        lender_document = request.query_params.get('type', None)
+        if lender_document:
+            documents = documents.filter(lender_document=lender_document)
+        if request.query_params.get('active_only') in ('1', 'true'):
+            documents = documents.filter(lender_document__active_document=F('document_id'))
+
+        results = []
+        for document in search_documents(documents, query, KeysetPagination().get_page_size(request)):
+            data = DocumentSerializer(document, many=False).data
+            data['rank'] = document.rank
+            results.append(data)
+        return JsonResponse({'results': results}, status=200)
+
+    @list_route(methods=['get'])
+    def export(self, request):
+        # Streams an archive of document bodies and their metadata
+        archive_format = request.query_params.get('archive', 'zip')
+        if archive_format not in ARCHIVE_CONTENT_TYPES:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        documents = self.get_queryset().select_related('lender_document')
+        lender_id = request.query_params.get('lender_id', None)
+        if lender_id:
+            documents = documents.filter(lender_id=lender_id)
+        lender_document = request.query_params.get('type', None)
+        if lender_document:
+            documents = documents.filter(lender_document=lender_document)
+        if request.query_params.get('active_only') in ('1', 'true'):
+            documents = documents.filter(lender_document__active_document=F('document_id'))
+        documents = documents.order_by('lender_document_id', 'version_major', 'version_minor', 'document_id')
+
+        response = StreamingHttpResponse(
+            export_documents(documents.iterator(), archive_format),
+            content_type=ARCHIVE_CONTENT_TYPES[archive_format]
+        )
+        response['Content-Disposition'] = 'attachment; filename="documents.{}"'.format(archive_format)
+        return response
+
+    @detail_route(methods=['get'])
+    def diff(self, request, pk=None):
+        # Changes made by this version compared to another one, by default the active one
+        granularity = request.query_params.get('granularity', 'line')
+        try:
+            document = self.get_queryset().select_related('lender_document__active_document').get(document_id=pk)
+            against = request.query_params.get('against', 'active')
+            if against == 'active':
+                against = document.lender_document.active_document
+            else:
+                against = self.get_queryset().get(document_id=against)
+            if granularity not in GRANULARITIES:
+                raise ValueError(granularity)
+        except:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        if against is None:
+            return JsonResponse({'error_msg': 'No active document.'}, status=404)
+        if not document.has_text_content() or not against.has_text_content():
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        data = dict(document.diff(against, granularity), document_id=document.document_id, against_document_id=against.document_id)
+        return JsonResponse(data, status=200)
 
     @detail_route(permission_classes=[DocumentModelPublishPermission], methods=['post'])
     def publish(self, request, pk=None):
@@ -63,10 +277,7 @@ class DocumentViewSet(mixins.CreateModelMixin,
         except:
             return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
         document = document.publish()
-        serializer = DocumentSerializer(document, many=False)
-        data = serializer.data
-        data['content'] = document.get_content()
-        return JsonResponse(data, status=200, safe=False)
+        return JsonResponse(serialize_with_content(document), status=200, safe=False)
     
     @detail_route(permission_classes=[DocumentModelRevertPermission], methods=['post'])
     def revert(self, request, pk=None):
@@ -74,41 +285,209 @@ class DocumentViewSet(mixins.CreateModelMixin,
             document = self.get_queryset().get(document_id=pk)
         except:
             return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
-        reverted_document = document.revert(request.user)
-        serializer = DocumentSerializer(reverted_document, many=False)
-        data = serializer.data
-        data['content'] = reverted_document.get_content()
-        return JsonResponse(data, status=200, safe=False)
+        reverted_document = document.revert(request.user) or document # Reverting the active document is a no-op
+        return JsonResponse(serialize_with_content(reverted_document), status=200, safe=False)
 
     def get_queryset(self):
+        documents = Document.objects.select_related('created_by')
+        if self.request.user.is_superuser:
+            return documents
+        return documents.filter(lender_id=get_principal(self.request.user).lender_id)
+
+    def get_lender_documents(self):
+        # Document types the user may add versions to
         if self.request.user.is_superuser:
-            return Document.objects.all()
-        return Document.objects.filter(lender_document__lender=self.request.user.profile.lender)
+            return LenderDocument.objects.all()
+        return LenderDocument.objects.filter(lender_id=get_principal(self.request.user).lender_id)
 
 
-class LenderDocumentViewSet(mixins.RetrieveModelMixin,
+class LenderDocumentViewSet(ReplicaReadMixin,
+                            mixins.RetrieveModelMixin,
                             mixins.ListModelMixin,
                             viewsets.GenericViewSet):
-    authentication_classes = (JSONWebTokenAuthentication,)
+    authentication_classes = (CachedJSONWebTokenAuthentication,)
     permission_classes = (LenderDocumentModelPermission,)
 
     def list(self, request):
-        lender_documents = self.get_queryset().all()
-        serializer = LenderDocumentSerializer(lender_documents, many=True)
-        return JsonResponse(serializer.data, status=200, safe=False)
+        query_params = request.query_params
+        lender_documents = self.get_queryset()
+        try:
+            fields = self.get_fields()
+            if 'name' in query_params:
+                lender_documents = lender_documents.filter(name__startswith=query_params['name'])
+            if 'has_active' in query_params:
+                lender_documents = lender_documents.filter(
+                    active_document__isnull=query_params['has_active'] not in ('1', 'true')
+                )
+            if 'updated_since' in query_params:
+                updated_since = parse_datetime(query_params['updated_since'])
+                if updated_since is None:
+                    raise ValueError(query_params['updated_since'])
+                if timezone.is_naive(updated_since):
+                    updated_since = timezone.make_aware(updated_since)
+                lender_documents = lender_documents.filter(updated_at__gte=updated_since)
+        except ValueError:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+
+        # Ordered by the listing index, which holds every column selected here
+        # except the active version
+        if uses_keyset_pagination(request):
+            self._paginator = LenderDocumentKeysetPagination()
+        ordering = LenderDocumentKeysetPagination.ordering
+        columns = [column for column in lender_document_values(fields) if column not in ordering]
+        lender_documents = lender_documents.order_by(*ordering).values(*ordering, *columns)
+        lender_documents = self.paginate_queryset(lender_documents)
+        return self.get_paginated_response(serialize_lender_document_values(lender_documents, fields))
+
+    def get_fields(self):
+        # Sparse fieldsets, e.g. ?fields=lender_document_id,active_version
+        if 'fields' not in self.request.query_params:
+            return LenderDocumentSerializer.Meta.fields
+        fields = [f.strip() for f in self.request.query_params['fields'].split(',') if f.strip()]
+        if not fields or any(f not in LENDER_DOCUMENT_FIELDS for f in fields):
+            raise ValueError(fields)
+        return fields
+
+    def retrieve(self, request, pk=None):
+        try:
+            lender_document = self.get_queryset().get(lender_document_id=pk)
+        except:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        not_modified = conditional_response(request, lender_document.etag(), lender_document.last_modified())
+        if not_modified:
+            return not_modified
+        serializer = LenderDocumentSerializer(lender_document, many=False)
+        response = JsonResponse(serializer.data, status=200, safe=False)
+        return set_validators(response, lender_document.etag(), lender_document.last_modified())
+
+    @detail_route(permission_classes=[DocumentModelPermission], methods=['get'])
+    def active(self, request, pk=None):
+        try:
+            lender_document = self.get_queryset().select_related('active_document__created_by').get(lender_document_id=pk)
+        except:
+            return JsonResponse({'error_msg': 'Invalid request.'}, status=400)
+        document = lender_document.active_document
+        if document is None:
+            return JsonResponse({'error_msg': 'No active document.'}, status=404)
+        not_modified = conditional_response(request, document.etag(), document.last_modified())
+        if not_modified:
+            return not_modified
+
+        data = DocumentSerializer(document, many=False).data
+        data['content'] = get_active_content(lender_document)
+        if data['content'] is None and document.has_text_content():
+            data['content'] = document.cache_active_content()
+        response = JsonResponse(data, status=200, safe=False)
+        return set_validators(response, document.etag(), document.last_modified())
 
     def create(self, request):
         serializer = LenderDocumentSerializer(data=request.data, many=False)
-        lender = request.user.profile.lender
+        lender_id = get_principal(request.user).lender_id
         if serializer.is_valid():
-            serializer.save(lender=lender, active_document=None)
+            serializer.save(lender_id=lender_id, active_document=None)
             return JsonResponse(serializer.data, status=201, safe=False)
         return JsonResponse(serializer.errors, status=400)
 
     def get_queryset(self):
+        lender_documents = LenderDocument.objects.select_related('active_document')
         if self.request.user.is_superuser:
-            return LenderDocument.objects.all()
-        return LenderDocument.objects.filter(lender=self.request.user.profile.lender)
+            return lender_documents
+        return lender_documents.filter(lender_id=get_principal(self.request.user).lender_id)
+
+
+class DocumentContentResponse(FileResponse):
+    block_size = settings.DOCUMENT_STREAM_CHUNK_SIZE
+
+
+def conditional_response(request, etag, last_modified):
+    # A 304 (or 412) response when the client's validators make the body
+    # unnecessary, decided before any content is fetched
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def accepts_encoding(request, content_encoding):
+    accepted = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for coding in accepted.split(','):
+        name, _, params = coding.strip().partition(';')
+        if name.strip().lower() == content_encoding and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            return True
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def uses_keyset_pagination(request):
+    query_params = request.query_params
+    return query_params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in query_params
+
+
+def serialize_with_content(document):
+    # Binary bodies are left out of JSON responses and served by the content endpoint
+    data = DocumentSerializer(document, many=False).data
+    data['content'] = document.get_content() if document.has_text_content() else None
+    return data
+
+
+def uses_download_url(request, document):
+    # Delta-encoded bodies can only be rebuilt here, and spooled bodies are not
+    # in the repository yet, so both are always inline
+    if not settings.DOCUMENT_DIRECT_TRANSFER or document.is_delta() or document.is_pending():
+        return False
+    return request.query_params.get('transfer') != 'inline'
+
+
+def serialize_with_content_url(request, document):
+    data = DocumentSerializer(document, many=False).data
+    expires_in = settings.DOCUMENT_DOWNLOAD_URL_EXPIRES
+    content_url = get_document_repository().presigned_url(
+        document.s3_bucket_key, 'GET', expires_in, document.content_type, document.content_encoding
+    )
+    data['content'] = None
+    data['content_url'] = request.build_absolute_uri(content_url)
+    data['content_url_expires_in'] = expires_in
+    return data
+
+
+@csrf_exempt
+def transfer(request, token):
+    # Serves and accepts bodies for signed transfer URLs, like S3 does for presigned ones
+    try:
+        transfer = load_token(token, TRANSFER_SALT)
+    except signing.BadSignature:
+        return JsonResponse({'error_msg': 'Invalid or expired URL.'}, status=403)
+    if request.method != transfer['method']:
+        return JsonResponse({'error_msg': 'Invalid request.'}, status=405)
+
+    document_repository = get_document_repository()
+    if request.method == 'GET':
+        try:
+            f = document_repository.open_read(transfer['key'])
+        except FileNotFoundError:
+            return JsonResponse({'error_msg': 'Not found.'}, status=404)
+        response = DocumentContentResponse(f, content_type=transfer['content_type'] or 'application/octet-stream')
+        if transfer['content_encoding'] not in (None, 'identity'):
+            response['Content-Encoding'] = transfer['content_encoding']
+        return response
+
+    with document_repository.open_write(transfer['key'], transfer['content_type']) as f:
+        for chunk in iter(lambda: request.read(settings.DOCUMENT_STREAM_CHUNK_SIZE), b''):
+            f.write(chunk)
+    return JsonResponse({}, status=201)
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def metrics_view(request):
+    # Request and span duration histograms by endpoint, since this process started
+    return JsonResponse({'endpoints': metrics.snapshot()}, status=200)
 
 
 def test(request):
@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from api.documentrepository import get_document_repository
+from api.models import Document, SpooledBody
+
+# Uploads bodies spooled by write-behind document creation. Each pass takes a
+# batch of spooled bodies, those that failed least often first, uploads them
+# concurrently and then marks their versions as stored. Bodies that could not
+# be uploaded stay spooled for the next pass.
+
+RETRY_DELAY = 0.5
+
+
+def drain_spool(batch_size=100, retries=None):
+    # Returns the number of bodies uploaded and the number that failed
+    retries = settings.DOCUMENT_WRITE_BEHIND_RETRIES if retries is None else retries
+    spooled = list(SpooledBody.objects.order_by('attempts', 'spooled_at')[:batch_size])
+    if not spooled:
+        return 0, 0
+    uploaded, failed = [], []
+    max_workers = min(settings.DOCUMENT_FETCH_MAX_WORKERS, len(spooled))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(body, executor.submit(upload, body, retries)) for body in spooled]
+        for body, future in futures:
+            try:
+                future.result()
+                uploaded.append(body.s3_bucket_key)
+            except Exception as e:
+                failed.append((body, e))
+
+    # Deleting first means a body spooled again under the same key after this
+    # point is kept, while any version committed before the update is marked
+    with transaction.atomic():
+        SpooledBody.objects.filter(s3_bucket_key__in=uploaded).delete()
+        Document.objects.filter(s3_bucket_key__in=uploaded, storage_state=Document.PENDING).update(
+            storage_state=Document.STORED
+        )
+    for body, e in failed:
+        SpooledBody.objects.filter(s3_bucket_key=body.s3_bucket_key).update(
+            attempts=F('attempts') + 1, last_error=repr(e)
+        )
+    return len(uploaded), len(failed)
+
+
+def upload(spooled, retries):
+    data = bytes(spooled.body)
+    for attempt in range(retries + 1):
+        try:
+            with get_document_repository().open_write(
+                spooled.s3_bucket_key, spooled.content_type, spooled.content_encoding
+            ) as f:
+                f.write(data)
+            return
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_DELAY * 2 ** attempt)
@@ -35,6 +35,11 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 ]
 
+# Django 2.0 only reads MIDDLEWARE; MIDDLEWARE_CLASSES below is kept for reference
+MIDDLEWARE = [
+    'api.middleware.InstrumentationMiddleware',
+]
+
 MIDDLEWARE_CLASSES = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -50,14 +55,106 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'api.authentication.CachedJSONWebTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.instrumentation.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 20,
 }
 
+# Document repository backend, 'local', 's3' or 'memory'. Defaults to 'local' when
+# ENV is 'local' and to 's3' otherwise. 'memory' keeps bodies in process and waits
+# DOCUMENT_REPOSITORY_SIMULATED_LATENCY seconds per call, for benchmarks.
+DOCUMENT_REPOSITORY_BACKEND = None
+DOCUMENT_REPOSITORY_SIMULATED_LATENCY = 0
+
+# Size budget of the in-process document content cache, 0 disables it
+DOCUMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Store document bodies under the SHA-256 of their content so identical bodies
+# are uploaded once. Existing bodies are moved with `manage.py migrate_content_addressed`.
+DOCUMENT_CONTENT_ADDRESSED = False
+
+# Codec applied to stored text document bodies, e.g. 'gzip'. None stores them as is.
+DOCUMENT_COMPRESSION = None
+
+# Store each text version created through the API as a line delta against its
+# predecessor, with a full snapshot every N versions so that rebuilding a body
+# never applies more than N - 1 deltas. 0 stores every version in full.
+DOCUMENT_DELTA_SNAPSHOT_INTERVAL = 0
+
+# Size budget of the in-process cache of bodies rebuilt from deltas
+DOCUMENT_DELTA_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# Spool the bodies of versions created through the API to the database, leaving
+# `manage.py drain_spool` to upload them, rather than waiting on the repository.
+# Versions are pending, and read from the spool, until their body is uploaded.
+# The drain makes up to DOCUMENT_WRITE_BEHIND_RETRIES further attempts per body.
+DOCUMENT_WRITE_BEHIND = False
+DOCUMENT_WRITE_BEHIND_RETRIES = 3
+
+# Read size used when streaming document bodies in and out of the repository
+DOCUMENT_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Cache holding the content of each lender document's active version, and the
+# largest content (in characters) worth keeping there
+ACTIVE_CONTENT_CACHE = 'default'
+ACTIVE_CONTENT_CACHE_TIMEOUT = 24 * 60 * 60
+ACTIVE_CONTENT_CACHE_MAX_LENGTH = 1024 * 1024
+
+# Cache of resolved users, lenders and permissions used for authorization, None
+# to resolve them on every request. Changes reach other processes only through
+# this cache, so it must be shared by all of them, e.g. memcached through
+# SHARED_CACHE_LOCATION; a local-memory cache is refused. Should the cache lose
+# an invalidation, entries are served stale for up to PRINCIPAL_CACHE_TIMEOUT
+# seconds, so keep it short.
+PRINCIPAL_CACHE = None
+PRINCIPAL_CACHE_TIMEOUT = 60
+
+# Upper bound on threads used to fetch document contents concurrently
+DOCUMENT_FETCH_MAX_WORKERS = 8
+
+# Index the content of new text documents for the search endpoint. The backend is
+# 'postgres' (full-text search) or 'table' (portable inverted index), by default
+# chosen from the database engine. Existing documents are indexed with
+# `manage.py index_documents`.
+DOCUMENT_SEARCH_INDEX = True
+DOCUMENT_SEARCH_BACKEND = None
+DOCUMENT_SEARCH_CONFIG = 'english'
+
+# Let clients transfer document bodies with the repository directly, through
+# presigned URLs on S3 or signed URLs of /api/transfer/ otherwise. Creating a
+# document without content then returns an upload URL, and retrieving one
+# returns a download URL instead of the content. Lifetimes are in seconds.
+DOCUMENT_DIRECT_TRANSFER = False
+DOCUMENT_DOWNLOAD_URL_EXPIRES = 5 * 60
+DOCUMENT_UPLOAD_URL_EXPIRES = 60 * 60
+
+# Number of document bodies read ahead of the one being written by exports
+DOCUMENT_EXPORT_READ_AHEAD = 16
+
+# Cache of diffs between two versions, returned by the document diff endpoint
+DOCUMENT_DIFF_CACHE = 'default'
+DOCUMENT_DIFF_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# Per-request query limit checked by api.middleware.QueryBudgetMiddleware when
+# it is added to MIDDLEWARE. Over-budget requests are logged, or fail if strict.
+QUERY_BUDGET = None
+QUERY_BUDGET_STRICT = False
+
+# Time queries, repository calls, serialization and rendering of each request.
+# The timings feed per-endpoint histograms served at /api/metrics/ to staff, a
+# Server-Timing response header and, when INSTRUMENTATION_LOG is set, one JSON
+# log line per request on the api.middleware logger.
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_SERVER_TIMING = True
+INSTRUMENTATION_LOG = False
+
 ZAPPA_SETTINGS = {
     'testing': {
        's3_bucket': 'incendier-storage',
@@ -103,10 +200,36 @@ try:
             'NAME': os.path.join(BASE_DIR, 'testdb.sqlite3'),
         }
     }
+    # Read replicas of the default database, e.g. DB_REPLICA_HOSTS=replica-1,replica-2
+    for i, host in enumerate(h.strip() for h in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if h.strip()):
+        DATABASES['replica_{}'.format(i)] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    # Memcached servers shared by every container, e.g. SHARED_CACHE_LOCATION=host-1:11211,host-2:11211
+    if os.environ.get('SHARED_CACHE_LOCATION'):
+        CACHES = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {
+                'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+                'LOCATION': os.environ['SHARED_CACHE_LOCATION'].split(','),
+            },
+        }
+        PRINCIPAL_CACHE = 'shared'
 except Exception as e: # Import local settings
     print('Environmental variables not set. Attempting to use local settings...')
     from .local_settings import *
 
+# Databases that reads of the document and lender document endpoints are spread
+# over, by default every alias starting with 'replica'. Replicas are health checked
+# every DATABASE_REPLICA_HEALTH_CHECK_INTERVAL seconds, and on PostgreSQL also
+# skipped while more than DATABASE_REPLICA_MAX_LAG seconds behind when it is set.
+# A client reads from the primary for DATABASE_REPLICA_STICKY_SECONDS after writing,
+# pinned by a signed cookie named DATABASE_REPLICA_STICKY_COOKIE.
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica')]
+DATABASE_REPLICA_HEALTH_CHECK_INTERVAL = 10
+DATABASE_REPLICA_MAX_LAG = None
+DATABASE_REPLICA_STICKY_SECONDS = 10
+DATABASE_REPLICA_STICKY_COOKIE = 'primary_pin'
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 